@@ -10,15 +10,17 @@ __status__ = 'Development'
 __license__ = 'Apache 2.0'
 
 import pandas as pd
-from random import sample
-from scipy.stats import sem, t
+from random import choice
+from scipy.stats import t
 import numpy as np
 import os
+from hashlib import blake2b
+from warnings import catch_warnings, simplefilter
 import multiprocessing as mp
-from anuran.utils import _generate_centralities_parallel
+from anuran.utils import _generate_centralities_parallel, _update_digest, _load_cache, _dump_cache
 
 
-def generate_ci_frame(networks, random, degree, fractions, prev, perm, core):
+def generate_ci_frame(networks, random, degree, fractions, prev, perm, core, cache=None, pool=None):
     """
     This function estimates centralities from all networks provided in
     the network, random and degree lists.
@@ -44,120 +46,246 @@ def generate_ci_frame(networks, random, degree, fractions, prev, perm, core):
     :param prev: List with prevalence of shared interactions
     :param perm: Number of sets to take from null models
     :param core: Number of processor cores
+    :param cache: Directory for storing the dataframe, so it is only calculated once for the same null models
+    :param pool: Multiprocessing pool; if not given, a pool is started for this function
     :return: List of lists with set sizes
     """
-    # Create empty pandas dataframe
-    results = pd.DataFrame(columns=['Node', 'Network', 'Group', 'Network type', 'Conserved fraction',
-                                    'Prevalence of conserved fraction',
-                                    'Centrality', 'Upper limit', 'Lower limit', 'Values'])
+    if cache:
+        fp = os.path.join(cache, _ci_frame_key(networks, random, degree, fractions, prev, perm) +
+                          '_centralities.pkl')
+        results = _load_cache(fp)
+        if results is not None:
+            return results
+    # values are collected per column and converted to a dataframe once
+    rows = {column: list() for column in ['Node', 'Network', 'Group', 'Network type', 'Conserved fraction',
+                                          'Prevalence of conserved fraction',
+                                          'Centrality', 'Upper limit', 'Lower limit', 'Values']}
+    # a single pool is reused for all groups and null model types
+    own_pool = pool is None
+    if own_pool:
+        pool = mp.Pool(core)
     for x in networks:
         group = os.path.basename(x)
-        obs_networks = _generate_centralities_parallel(networks[x])
-        results = _generate_ci_rows(name='Input', data=results, group=group,
-                                    networks=obs_networks, fraction=None, prev=None)
+        # centralities of core models are cached per group,
+        # so networks with identical nodes and edges are only ranked once
+        centrality_cache = dict()
         # to reduce computational time, use lookup table for centralities
         # we add a third value to the tuple: centrality scores for the networks
-        # run centrality calculations in parallel
-        pool = mp.Pool(core)
-        degree_centralities = pool.map(_generate_centralities_parallel, degree[x]['degree'])
-        pool.close()
-        pool = mp.Pool(core)
-        random_centralities = pool.map(_generate_centralities_parallel, random[x]['random'])
-        pool.close()
+        # input, degree and random networks are submitted to the pool together
+        num_degree = len(degree[x]['degree'])
+        centralities = _map_centralities(pool, [networks[x]] + degree[x]['degree'] + random[x]['random'])
+        obs_networks = centralities[0]
+        degree_centralities = centralities[1:num_degree + 1]
+        random_centralities = centralities[num_degree + 1:]
+        rows = _generate_ci_rows(name='Input', rows=rows, group=group,
+                                 networks=obs_networks, fraction=None, prev=None)
         for i in range(perm):
-            degreeperm = [sample(degree_centralities[r], 1)[0] for r in range(len(degree_centralities))]
-            results = _generate_ci_rows(name='Degree', data=results, group=group,
-                                        networks=degreeperm, fraction=None, prev=None)
-            randomperm = [sample(random_centralities[r], 1)[0] for r in range(len(random_centralities))]
-            results = _generate_ci_rows(name='Random', data=results, group=group,
-                                        networks=randomperm, fraction=None, prev=None)
+            degreeperm = [choice(r) for r in degree_centralities]
+            rows = _generate_ci_rows(name='Degree', rows=rows, group=group,
+                                     networks=degreeperm, fraction=None, prev=None)
+            randomperm = [choice(r) for r in random_centralities]
+            rows = _generate_ci_rows(name='Random', rows=rows, group=group,
+                                     networks=randomperm, fraction=None, prev=None)
         if fractions:
             num_models = len(random[group]['core'][fractions[0]][prev[0]])
             for frac in fractions:
                 for c in prev:
                     for i in range(num_models):
                         degreeperm = degree[x]['core'][frac][c][i]
-                        degreeperm = _generate_centralities_parallel(degreeperm)
+                        degreeperm = _cached_centralities(degreeperm, centrality_cache)
                         randomperm = random[x]['core'][frac][c][i]
-                        randomperm = _generate_centralities_parallel(randomperm)
-                        results = _generate_ci_rows(name='Degree', data=results, group=group,
-                                                    networks=degreeperm, fraction=frac, prev=c)
-                        results = _generate_ci_rows(name='Random', data=results, group=group,
-                                                    networks=randomperm, fraction=frac, prev=c)
+                        randomperm = _cached_centralities(randomperm, centrality_cache)
+                        rows = _generate_ci_rows(name='Degree', rows=rows, group=group,
+                                                 networks=degreeperm, fraction=frac, prev=c)
+                        rows = _generate_ci_rows(name='Random', rows=rows, group=group,
+                                                 networks=randomperm, fraction=frac, prev=c)
+    if own_pool:
+        pool.close()
+    results = pd.DataFrame(rows)
+    # confidence limits of percentile ranks do not need double precision
+    results['Upper limit'] = results['Upper limit'].astype(np.float32)
+    results['Lower limit'] = results['Lower limit'].astype(np.float32)
+    # the string columns only contain a handful of distinct values;
+    # categories keep the order of appearance so figures still start with the input networks
+    for column in ['Network', 'Group', 'Network type', 'Centrality']:
+        results[column] = pd.Categorical(results[column], categories=pd.unique(results[column]))
+    if cache:
+        os.makedirs(cache, exist_ok=True)
+        _dump_cache(results, fp)
     return results
 
 
-def _generate_ci_rows(data, name, group, networks, fraction, prev):
+def _ci_frame_key(networks, random, degree, fractions, prev, perm):
     """
-    Generates Pandas rows with all centrality measures for a list of networks.
+    Hashes the settings and all networks used by generate_ci_frame.
+
+    :param networks: List of input networks
+    :param random: Dictionary with permuted input networks without preserved degree distribution
+    :param degree: Dictionary with permuted input networks with preserved degree distribution
+    :param fractions: List with fractions of shared interactions
+    :param prev: List with prevalence of shared interactions
+    :param perm: Number of sets to take from null models
+    :return: Hexadecimal digest
+    """
+    digest = blake2b(repr((fractions, prev, perm)).encode(), digest_size=16)
+    for x in networks:
+        models = [networks[x]] + degree[x]['degree'] + random[x]['random']
+        if fractions:
+            for frac in fractions:
+                for c in prev:
+                    models.extend(degree[x]['core'][frac][c])
+                    models.extend(random[x]['core'][frac][c])
+        digest.update(x.encode())
+        for model_list in models:
+            for network in model_list:
+                digest.update(network[0].encode())
+                _update_digest(digest, network[1])
+    return digest.hexdigest()
+
 
-    :param data: Pandas dataframe
+def _map_centralities(pool, model_lists):
+    """
+    Calculates centralities for lists of networks with a multiprocessing pool.
+    Each network is submitted as a separate task with a chunksize of 1,
+    so idle workers pick up the next network instead of waiting
+    for a worker that received a list of large networks.
+
+    :param pool: Multiprocessing pool
+    :param model_lists: List of lists of networks, with networks given as a tuple (name and networkX object)
+    :return: List of lists of networks as tuples with name, NetworkX object and centrality dictionary
+    """
+    jobs = [[network] for model_list in model_lists for network in model_list]
+    results = pool.map(_generate_centralities_parallel, jobs, chunksize=1)
+    centralities = list()
+    start = 0
+    for model_list in model_lists:
+        end = start + len(model_list)
+        centralities.append([x[0] for x in results[start:end]])
+        start = end
+    return centralities
+
+
+def _cached_centralities(model_list, cache):
+    """
+    Adds centrality rankings to a list of networks,
+    but only calculates rankings for NetworkX objects that are not in the cache yet.
+    The cache uses a hash of the nodes and edges as key,
+    so identical permutations stored as different objects are also only ranked once.
+
+    :param model_list: List of networks, with networks given as a tuple (name and networkX object)
+    :param cache: Dictionary with previously calculated centrality tuples
+    :return: List of networks as tuples with name, NetworkX object and centrality dictionary
+    """
+    centrality_list = []
+    for network in model_list:
+        key = _graph_hash(network[1])
+        if key not in cache:
+            cache[key] = _generate_centralities_parallel([network])[0]
+        centrality_list.append((network[0], network[1], cache[key][2]))
+    return centrality_list
+
+
+def _graph_hash(network):
+    """
+    Hashes the sorted node and edge lists of a network,
+    so networks with the same content get the same key regardless of insertion order.
+
+    :param network: NetworkX object
+    :return: 128-bit digest
+    """
+    nodes = sorted(str(node) for node in network.nodes)
+    edges = sorted(tuple(sorted((str(edge[0]), str(edge[1])))) for edge in network.edges)
+    return blake2b(repr((nodes, edges)).encode(), digest_size=16).digest()
+
+
+def _generate_ci_rows(rows, name, group, networks, fraction, prev):
+    """
+    Generates column values with all centrality measures for a list of networks.
+    The values for all nodes in a confidence interval are added to the columns at once;
+    the columns are converted to a Pandas dataframe afterwards.
+
+    :param rows: Dictionary with column names as keys and lists of values
     :param name: Name for the list of NetworkX objects
     :param group: Name for grouping NetworkX objects
     :param networks: List of NetworkX objects as tuples:
     first item is network name, second NetworkX, third centrality dictionary
     :param fraction: If a null model with core is provided, adds the core fraction to the row
     :param prev: If a null model with core is provided, adds the core prevalence to the row
-    :return: Pandas dataframe with added rows
+    :return: Dictionary with column names as keys and lists of values
     """
     full_name = name + ' networks'
     if fraction:
         name += ' size: ' + str(fraction) + ' prev:' + str(prev)
     properties = networks[0][2].keys() # gets all centrality names
+    names = [x[0] for x in networks]
+    centralities = [x[2] for x in networks]
+    # columns that are the same for all centralities are extended once at the end
+    total = 0
     for centrality in properties:
-        centrality_scores = [(networks[i][0], networks[i][2][centrality]) for i in range(len(networks))]
+        centrality_scores = [x[centrality] for x in centralities]
         ci = generate_confidence_interval(centrality_scores)
-        for node in ci:
-            data = data.append({'Node': node,
-                                'Network': name,
-                                'Group': group,
-                                'Network type': full_name,
-                                'Conserved fraction': fraction,
-                                'Prevalence of conserved fraction': prev,
-                                'Centrality': centrality,
-                                'Upper limit': ci[node][1],
-                                'Lower limit': ci[node][0],
-                                'Values': [(x[0], _catch(x[1], node)) for
-                                           x in centrality_scores if _catch(x[1], node)]},
-                               ignore_index=True)
-    return data
+        n = len(ci)
+        total += n
+        rows['Node'].extend(ci.keys())
+        rows['Centrality'].extend([centrality] * n)
+        rows['Upper limit'].extend(x[1] for x in ci.values())
+        rows['Lower limit'].extend(x[0] for x in ci.values())
+        rows['Values'].extend([x for x in zip(names, (_catch(scores, node) for scores in centrality_scores))
+                               if x[1] is not None] for node in ci)
+    rows['Network'].extend([name] * total)
+    rows['Group'].extend([group] * total)
+    rows['Network type'].extend([full_name] * total)
+    rows['Conserved fraction'].extend([fraction] * total)
+    rows['Prevalence of conserved fraction'].extend([prev] * total)
+    return rows
 
 
 def generate_confidence_interval(ranking):
     """
     Given a list with centrality rankings calculated from multiple networks,
     this function calculates the confidence interval.
+    The rankings are stacked into an array with one row per network and one column per node,
+    so the intervals for all nodes are calculated at once.
 
-    :param ranking: List of centrality rankings for each network
+    :param ranking: List of centrality ranking dictionaries for each network
     :return: Dictionary with nodes as keys and tuples of confidence intervals as values
     """
-    nodes = list()
-    for x in ranking:
-        if x:
-            nodes.extend(x[1].keys())
-    ci = dict.fromkeys(set(nodes))
-    for node in ci:
-        # first constuct array of ranking
-        ranks = [_catch(x[1], node) for x in ranking if _catch(x[1], node)]
-        if len(ranks) == 1:
-            ci[node] = (np.nan, np.nan)
-        else:
-            mean, se, m = np.mean(ranks), sem(ranks), t.ppf((1 + 0.95) / 2., len(ranks) - 1)
-            interval = (mean - m*se, mean + m*se)
-            # confidence intervals below 0 or above 1 are meaningless
-            if interval[0] < 0:
-                interval = (0, interval[1])
-            if interval[1] > 1:
-                interval = (interval[0], 1)
-            ci[node] = interval
+    rankings = [x for x in ranking if x]
+    nodes = list(dict.fromkeys(node for x in rankings for node in x))
+    if len(nodes) == 0:
+        return dict()
+    index = {node: i for i, node in enumerate(nodes)}
+    # first construct array of rankings,
+    # with a mask for the nodes that are present in each network
+    ranks = np.zeros((len(rankings), len(nodes)))
+    observed = np.zeros((len(rankings), len(nodes)), dtype=bool)
+    for i, x in enumerate(rankings):
+        columns = [index[node] for node in x]
+        ranks[i, columns] = list(x.values())
+        observed[i, columns] = True
+    counts = observed.sum(axis=0)
+    with catch_warnings():
+        # nodes found in only one network give NaN values
+        simplefilter("ignore")
+        mean = ranks.sum(axis=0) / counts
+        deviations = np.where(observed, ranks - mean, 0)
+        se = np.sqrt((deviations ** 2).sum(axis=0) / (counts - 1)) / np.sqrt(counts)
+        # the t quantile only depends on the number of observations,
+        # so it is evaluated once per distinct count
+        unique_counts, count_index = np.unique(counts, return_inverse=True)
+        m = t.ppf((1 + 0.95) / 2., unique_counts - 1)[count_index]
+    # confidence intervals below 0 or above 1 are meaningless
+    lower = np.maximum(mean - m*se, 0)
+    upper = np.minimum(mean + m*se, 1)
+    lower[counts < 2] = np.nan
+    upper[counts < 2] = np.nan
+    ci = dict(zip(nodes, zip(lower.tolist(), upper.tolist())))
     return ci
 
 
-
 def _catch(dictionary, key):
-    try:
-        return dictionary[key]
-    except Exception:
-        return None
+    if dictionary is not None:
+        return dictionary.get(key)
+    return None
 
 
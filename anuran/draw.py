@@ -13,6 +13,7 @@ __status__ = 'Development'
 __license__ = 'Apache 2.0'
 
 import seaborn as sns
+import matplotlib.pyplot as plt
 
 
 def draw_sets(data, fp):
@@ -33,7 +34,7 @@ def draw_sets(data, fp):
                       data=data, kind='strip')
     fig.set_xticklabels(rotation=30)
     fig.savefig(fp + "_setsizes.png")
-    fig.fig.clf()
+    plt.close(fig.fig)
 
 
 def draw_set_differences(data, fp):
@@ -62,7 +63,7 @@ def draw_set_differences(data, fp):
                       data=data, kind='bar', order=order_intervals)
     fig.set_xticklabels(rotation=30)
     fig.savefig(fp + "_setdifferences.png")
-    fig.fig.clf()
+    plt.close(fig.fig)
 
 
 def draw_centralities(data, fp):
@@ -70,32 +71,19 @@ def draw_centralities(data, fp):
     This function accepts a pandas dataframe
     with 5 columns:
     Node, Network, Network type, Conserved fraction, Centrality, Upper limit, Lower limit
-    For every centrality a scatter plot is generated with the upper- and lower limits
-    on the x and y axes respectively.
+    A single figure is generated with a row of scatter plots per centrality,
+    with the upper- and lower limits on the x and y axes respectively.
 
     :param data: Pandas data frame
     :param fp: Filepath with prefix for name
     :return:
     """
     sns.set_style(style="whitegrid")
-    degree = data[data['Centrality'] == 'Degree']
-    fig = sns.relplot(x='Lower limit', y='Upper limit', col='Network',
-                      hue='Network', data=degree)
+    fig = sns.relplot(x='Lower limit', y='Upper limit', col='Network', row='Centrality',
+                      hue='Network', data=data)
     fig.set(ylim=(0, 1), xlim=(0, 1))
-    fig.savefig(fp + "_degree.png")
-    fig.fig.clf()
-    degree = data[data['Centrality'] == 'Betweenness']
-    fig = sns.relplot(x='Lower limit', y='Upper limit', col='Network',
-                      hue='Network', data=degree)
-    fig.set(ylim=(0, 1), xlim=(0, 1))
-    fig.savefig(fp + "_betweenness.png")
-    fig.fig.clf()
-    degree = data[data['Centrality'] == 'Closeness']
-    fig = sns.relplot(x='Lower limit', y='Upper limit', col='Network',
-                      hue='Network', data=degree)
-    fig.set(ylim=(0, 1), xlim=(0, 1))
-    fig.savefig(fp + "_closeness.png")
-    fig.fig.clf()
+    fig.savefig(fp + "_centralities.png")
+    plt.close(fig.fig)
 
 
 def draw_samples(data, fp):
@@ -119,7 +107,7 @@ def draw_samples(data, fp):
                            data=subdata)
         fig.set_xticks(range(1, max(subdata['Samples']) + 1))
         fig.figure.savefig(fp + "_" + val.replace(' ', '_') + "_samples.png")
-        fig.clear()
+        plt.close(fig.figure)
 
 
 def draw_graphs(data, fp):
@@ -137,4 +125,4 @@ def draw_graphs(data, fp):
                       data=data, kind='strip')
     fig.set_xticklabels(rotation=30)
     fig.savefig(fp + "_graph_properties.png")
-    fig.fig.clf()
+    plt.close(fig.fig)
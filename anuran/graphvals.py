@@ -12,9 +12,14 @@ __license__ = 'Apache 2.0'
 
 import pandas as pd
 import networkx as nx
-from random import sample
+from networkx.algorithms.connectivity import build_auxiliary_node_connectivity, local_node_connectivity
+from networkx.algorithms.flow import build_residual_network
+from random import sample, choice
 import numpy as np
 import os
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components, shortest_path
+from anuran.utils import _networkit, _edge_array
 
 
 def generate_graph_frame(networks, random, degree, fractions, core, perm):
@@ -41,22 +46,20 @@ def generate_graph_frame(networks, random, degree, fractions, core, perm):
     :param perm: Number of sets to take from null models
     :return: List of lists with set sizes
     """
-    # Create empty pandas dataframe
-    results = pd.DataFrame(columns=['Network', 'Name', 'Group', 'Network type', 'Conserved fraction',
-                                    'Prevalence of conserved fraction',
-                                    'Property', 'Value'])
+    # rows are collected as dictionaries and converted to a dataframe once
+    rows = list()
     for x in networks:
         group = os.path.basename(x)
-        results = _generate_graph_rows(name='Input', data=results, group=group,
-                                       networks=networks[x], fraction=None, prev=None, perm=None)
+        rows = _generate_graph_rows(name='Input', rows=rows, group=group,
+                                    networks=networks[x], fraction=None, prev=None, perm=None)
         # construct the subsampled model sets nperm times
         for i in range(perm):
-            degreeperm = [sample(degree[x]['degree'][r], 1)[0] for r in range(len(degree[x]['degree']))]
-            results = _generate_graph_rows(name='Degree', data=results, group=group,
-                                           networks=degreeperm, fraction=None, prev=None, perm=i)
-            randomperm = [sample(random[x]['random'][r], 1)[0] for r in range(len(random[x]['random']))]
-            results = _generate_graph_rows(name='Random', data=results, group=group,
-                                           networks=randomperm, fraction=None, prev=None, perm=i)
+            degreeperm = [choice(r) for r in degree[x]['degree']]
+            rows = _generate_graph_rows(name='Degree', rows=rows, group=group,
+                                        networks=degreeperm, fraction=None, prev=None, perm=i)
+            randomperm = [choice(r) for r in random[x]['random']]
+            rows = _generate_graph_rows(name='Random', rows=rows, group=group,
+                                        networks=randomperm, fraction=None, prev=None, perm=i)
         if fractions:
             num_models = len(random[group]['core'][fractions[0]][core[0]])
             for frac in fractions:
@@ -64,43 +67,52 @@ def generate_graph_frame(networks, random, degree, fractions, core, perm):
                     for i in range(num_models):
                         degreeperm = degree[x]['core'][frac][c][i]
                         randomperm = random[x]['core'][frac][c][i]
-                        results = _generate_graph_rows(name='Degree', data=results, group=group,
-                                                       networks=degreeperm, fraction=frac, prev=c, perm=None)
-                        results = _generate_graph_rows(name='Random', data=results, group=group,
-                                                       networks=randomperm, fraction=frac, prev=c, perm=None)
+                        rows = _generate_graph_rows(name='Degree', rows=rows, group=group,
+                                                    networks=degreeperm, fraction=frac, prev=c, perm=None)
+                        rows = _generate_graph_rows(name='Random', rows=rows, group=group,
+                                                    networks=randomperm, fraction=frac, prev=c, perm=None)
+    results = pd.DataFrame(rows, columns=['Network', 'Name', 'Group', 'Network type', 'Conserved fraction',
+                                          'Prevalence of conserved fraction',
+                                          'Property', 'Value', 'iteration'])
+    # the string columns only contain a handful of distinct values;
+    # categories keep the order of appearance so figures still start with the input networks
+    for column in ['Network', 'Group', 'Network type', 'Property']:
+        results[column] = pd.Categorical(results[column], categories=pd.unique(results[column]))
     return results
 
 
-def _generate_graph_rows(data, name, group, networks, fraction, prev, perm):
+def _generate_graph_rows(rows, name, group, networks, fraction, prev, perm):
     """
-    Generates Pandas rows with network measures for a list of networks.
+    Generates dictionaries with network measures for a list of networks.
+    These are appended to a list that is converted to a Pandas dataframe afterwards.
 
-    :param data: Pandas dataframe
+    :param rows: List of dictionaries
     :param name: Name for the list of NetworkX objects
     :param group: Name for grouping NetworkX objects
     :param networks: List of NetworkX objects
     :param fraction: If a null model with core is provided, adds the core fraction to the row
     :param prev: If a null model with core is provided, adds the core prevalence to the row
     :param perm: iteration of graph subsampling, necessary for permutation testing
-    :return: Pandas dataframe with added rows
+    :return: List of dictionaries with added rows
     """
     full_name = name + ' networks'
     if fraction:
         name += ' size: ' + str(fraction) + ' prev:' + str(prev)
     properties = generate_graph_properties(networks)
+    # values shared by all rows are only set once
+    template = {'Network': name,
+                'Group': group,
+                'Network type': full_name,
+                'Conserved fraction': fraction,
+                'Prevalence of conserved fraction': prev,
+                'iteration': perm}
     for property in properties:
         for network in properties[property]:
-            data = data.append({'Network': name,
-                                'Name': network[0],
-                                'Group': group,
-                                'Network type': full_name,
-                                'Conserved fraction': fraction,
-                                'Prevalence of conserved fraction': prev,
-                                'Property': property,
-                                'Value': network[1],
-                                'iteration': perm},
-                               ignore_index=True)
-    return data
+            rows.append({**template,
+                         'Name': network[0],
+                         'Property': property,
+                         'Value': network[1]})
+    return rows
 
 
 def generate_graph_properties(networks):
@@ -109,6 +121,7 @@ def generate_graph_properties(networks):
     Instead of using the absolute degree or betweenness centrality, this takes metric bias into account.
 
     If the graph is not connected, the values are calculated for the largest connected component.
+    For larger networks, the average node connectivity is estimated from a sample of node pairs.
 
     :param networks: List of input networks
     :return: Pandas dataframe with rankings
@@ -119,25 +132,13 @@ def generate_graph_properties(networks):
         properties[property] = list()
     for network in networks:
         if len(network[1].nodes) > 0:
-            properties['Assortativity'].append((network[0],
-                                                nx.degree_pearson_correlation_coefficient(network[1])))
+            properties['Assortativity'].append((network[0], _assortativity(network[1])))
             properties['Connectivity'].append((network[0],
-                                               nx.average_node_connectivity(network[1])))
-            if nx.is_connected(network[1]):
-                properties['Diameter'].append((network[0], nx.diameter(network[1])))
-                properties['Radius'].append((network[0], nx.radius(network[1])))
-                properties['Average shortest path length'].append((network[0],
-                                                                   nx.average_shortest_path_length(network[1])))
-            else:
-                components = list(nx.connected_components(network[1]))
-                sizes = []
-                for component in components:
-                    sizes.append(len(component))
-                subnetwork = nx.subgraph(network[1], components[np.where(np.max(sizes) == sizes)[0][0]])
-                properties['Diameter'].append((network[0], nx.diameter(subnetwork)))
-                properties['Radius'].append((network[0], nx.radius(subnetwork)))
-                properties['Average shortest path length'].append((network[0],
-                                                                  nx.average_shortest_path_length(subnetwork)))
+                                               _approx_connectivity(network[1])))
+            diameter, radius, path_length = _path_properties(network[1])
+            properties['Diameter'].append((network[0], diameter))
+            properties['Radius'].append((network[0], radius))
+            properties['Average shortest path length'].append((network[0], path_length))
         else:
             properties['Assortativity'].append(None)
             properties['Connectivity'].append(None)
@@ -147,3 +148,100 @@ def generate_graph_properties(networks):
     return properties
 
 
+def _assortativity(network):
+    """
+    Calculates the degree assortativity of a network
+    as the Pearson correlation between the degrees of nodes connected by an edge.
+    The degrees are taken from the cached edge array,
+    so this gives the same value as the NetworkX degree_pearson_correlation_coefficient
+    without iterating over the edges in Python.
+
+    :param network: NetworkX object
+    :return: Degree assortativity
+    """
+    nodes, pairs, signs = _edge_array(network)
+    degree = np.bincount(pairs.ravel(), minlength=len(nodes))
+    # each edge contributes both directions, self-loops only once
+    loops = pairs[:, 0] == pairs[:, 1]
+    x = np.concatenate([degree[pairs[:, 0]], degree[pairs[~loops, 1]]]).astype(np.float64)
+    y = np.concatenate([degree[pairs[:, 1]], degree[pairs[~loops, 0]]]).astype(np.float64)
+    if len(x) < 2:
+        return np.nan
+    x -= x.mean()
+    y -= y.mean()
+    denominator = np.sqrt((x * x).sum() * (y * y).sum())
+    if denominator == 0:
+        return np.nan
+    return float((x * y).sum() / denominator)
+
+
+def _path_properties(network):
+    """
+    Calculates the diameter, radius and average shortest path length of a network.
+    If the graph is not connected, the values are calculated for the largest connected component.
+    The network is converted to a sparse adjacency matrix once;
+    all three properties are derived from a single all-pairs shortest path calculation,
+    which uses NetworKit if it is available and SciPy otherwise.
+
+    :param network: NetworkX object
+    :return: Tuple with diameter, radius and average shortest path length
+    """
+    nodes, pairs, signs = _edge_array(network)
+    matrix = csr_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(len(nodes), len(nodes)))
+    count, labels = connected_components(matrix, directed=False)
+    if count > 1:
+        keep = np.flatnonzero(labels == np.argmax(np.bincount(labels)))
+        matrix = matrix[keep][:, keep]
+    n = matrix.shape[0]
+    if n < 2:
+        return 0, 0, 0
+    if _networkit():
+        distances = _nk_distances(matrix)
+    else:
+        distances = shortest_path(matrix, directed=False, unweighted=True)
+    eccentricity = distances.max(axis=1)
+    path_length = distances.sum() / (n * (n - 1))
+    return int(eccentricity.max()), int(eccentricity.min()), float(path_length)
+
+
+def _nk_distances(matrix):
+    """
+    Calculates the distance matrix of a connected network with the parallel NetworKit APSP.
+
+    :param matrix: Sparse adjacency matrix
+    :return: NumPy array with shortest path lengths
+    """
+    nk = _networkit()
+    edges = matrix.tocoo()
+    graph = nk.Graph(matrix.shape[0], directed=False)
+    for u, v in zip(edges.row.tolist(), edges.col.tolist()):
+        graph.addEdge(u, v)
+    return np.asarray(nk.distance.APSP(graph).run().getDistances())
+
+
+def _approx_connectivity(network, k=50):
+    """
+    Estimates the average node connectivity of a network.
+    The exact average requires a maximum flow calculation for every pair of nodes,
+    so for networks with more than k node pairs, the average is taken over k randomly sampled pairs.
+
+    :param network: NetworkX object
+    :param k: Maximum number of node pairs
+    :return: Average node connectivity
+    """
+    nodes = list(network)
+    if len(nodes) * (len(nodes) - 1) // 2 <= k:
+        return nx.average_node_connectivity(network)
+    # pairs are drawn directly instead of listing all pairs,
+    # which would take quadratic memory for large networks
+    pairs = set()
+    while len(pairs) < k:
+        pairs.add(tuple(sorted(sample(range(len(nodes)), 2))))
+    pairs = [(nodes[u], nodes[v]) for u, v in pairs]
+    # the auxiliary digraph and residual network are reused for all pairs
+    auxiliary = build_auxiliary_node_connectivity(network)
+    residual = build_residual_network(auxiliary, 'capacity')
+    total = 0
+    for u, v in pairs:
+        total += local_node_connectivity(network, u, v, auxiliary=auxiliary, residual=residual)
+    return total / k
@@ -25,21 +25,16 @@ import networkx as nx
 import sys
 import os
 import argparse
-import glob
-from multiprocessing import cpu_count
+import numpy as np
+from multiprocessing import cpu_count, Pool
+from multiprocessing.pool import ThreadPool
 from pbr.version import VersionInfo
 import logging.handlers
 
 import anuran
-from anuran.utils import _intersection, _construct_intersection
+from anuran.utils import _intersections, _construct_intersection, _edge_array
 from anuran.nulls import generate_null
 from anuran.sets import generate_sizes, generate_sample_sizes, generate_size_differences
-from anuran.draw import draw_sets, draw_samples, draw_centralities, \
-    draw_graphs, draw_set_differences
-from anuran.centrality import generate_ci_frame
-from anuran.graphvals import generate_graph_frame
-from anuran.stats import compare_set_sizes, compare_centralities, compare_graph_properties, \
-    correlate_centralities, correlate_graph_properties
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -52,6 +47,18 @@ sh.setFormatter(formatter)
 logger.addHandler(sh)
 
 
+# readers for supported network formats, by file extension
+_READERS = {'.graphml': nx.read_graphml,
+            '.txt': nx.read_weighted_edgelist,
+            '.gml': nx.read_gml}
+
+
+# file extensions for supported output formats
+_EXTENSIONS = {'csv': '.csv',
+               'parquet': '.parquet',
+               'feather': '.feather'}
+
+
 def set_anuran():
     """This parser gets input settings for running anuran.
     It requires an input format that can be read by NetworkX.
@@ -197,6 +204,33 @@ def set_anuran():
                         help='Number of processing cores to use. \n '
                              'By default, CPU count - 1. ',
                         default=cpu_count()-1)
+    parser.add_argument('-cache', '--cache-dir',
+                        dest='cache_dir',
+                        required=False,
+                        help='Directory for storing generated null models. \n'
+                             'Null models generated with the same networks and settings \n'
+                             'are loaded from this directory instead of generated again. \n'
+                             'By default, null models are not cached. ',
+                        default=None)
+    parser.add_argument('-format', '--format',
+                        dest='format',
+                        required=False,
+                        help='Format for exported tables. \n'
+                             'Parquet and feather files are smaller and faster to write, \n'
+                             'but require pyarrow. \n'
+                             'Default: csv. ',
+                        choices=['csv', 'parquet', 'feather'],
+                        default='csv')
+    parser.add_argument('-iformat', '--intersection_format',
+                        dest='intersection_format',
+                        required=False,
+                        help='Format for exported intersections. \n'
+                             'Graphml files include node metadata and edge weights of the input networks. \n'
+                             'Npz files only contain a sparse matrix with edge signs and the node names, \n'
+                             'but are much faster to write for large intersections. \n'
+                             'Default: graphml. ',
+                        choices=['graphml', 'npz'],
+                        default='graphml')
     parser.add_argument('-version', '--version',
                         dest='version',
                         required=False,
@@ -215,6 +249,7 @@ def main():
         sys.exit(0)
     if not args['graph']:
         logger.info('Please give an input location.')
+    args['format'] = _check_format(args['format'])
     if not args['fp']:
         logger.info('No file path given, writing to current directory.')
         args['fp'] = os.getcwd() + '/'
@@ -238,35 +273,28 @@ def main():
                 new_graph.append(location)
         args['graph'] = new_graph
         # code for importing from multiple folders
+        # files from all folders are read together in parallel threads,
+        # so a folder with few files does not leave threads idle
+        files = list()
         for location in args['graph']:
-            files = [f for f in glob.glob(location + "**/*.graphml", recursive=True)]
-            files.extend([f for f in glob.glob(location + "**/*.txt", recursive=True)])
-            files.extend([f for f in glob.glob(location + "**/*.gml", recursive=True)])
-            for file in files:
-                filename = file.split(sep=".")
-                extension = filename[len(filename)-1]
-                try:
-                    if extension == 'graphml':
-                        network = nx.read_graphml(file)
-                    elif extension == 'txt':
-                        network = nx.read_weighted_edgelist(file)
-                    elif extension == 'gml':
-                        network = nx.read_gml(file)
-                    else:
-                        logger.warning('Ignoring file with wrong format.', exc_info=True)
-                        network = False
-                    # need to make sure the graphml function does not arbitrarily assign node ID
-                    if network:
-                        try:
-                            if 'name' in network.nodes[list(network.nodes)[0]]:
-                                if network.nodes[list(network.nodes)[0]]['name'] != list(network.nodes)[0]:
-                                    network = nx.relabel_nodes(network, nx.get_node_attributes(network, 'name'))
-                        except IndexError:
-                            logger.warning('One of the imported networks contains no nodes.', exc_info=True)
-                        networks[os.path.basename(location)].append((os.path.basename(file), nx.to_undirected(network)))
-                except Exception:
-                    logger.error('Could not import network file!', exc_info=True)
-                    sys.exit()
+            name = os.path.basename(location)
+            if len(name) == 0:
+                name = 'anuran'
+            found = list()
+            for root, dirs, filenames in os.walk(location):
+                found.extend(os.path.join(root, f) for f in filenames
+                             if os.path.splitext(f)[1] in _READERS)
+            files.extend((name, f) for f in sorted(found))
+        pool = ThreadPool(max(1, min(32, args['core'])))
+        try:
+            imported = pool.map(_read_network, [f for name, f in files])
+        except Exception:
+            logger.error('Could not import network file!', exc_info=True)
+            sys.exit()
+        finally:
+            pool.close()
+        for (name, f), network in zip(files, imported):
+            networks[name].append(network)
     elif args['graph'] == ['demo']:
         networks = {'demo': list()}
         path = os.path.dirname(anuran.__file__)
@@ -286,6 +314,176 @@ def main():
     exit(0)
 
 
+def _check_format(fmt):
+    """
+    Checks whether tables can be written in the requested format.
+    Parquet and feather files are written with pyarrow;
+    if it is not installed, tables are written to csv instead.
+
+    :param fmt: Output format: csv, parquet or feather
+    :return: Output format that can be written
+    """
+    if fmt == 'csv':
+        return fmt
+    try:
+        import pyarrow
+    except ImportError:
+        logger.warning('Writing ' + fmt + ' files requires pyarrow, which is not installed. \n'
+                       'Tables are exported to csv instead.')
+        return 'csv'
+    return fmt
+
+
+def _read_network(file):
+    """
+    Imports a network file with the reader that matches its extension.
+    If the nodes of a graphml file have a name attribute,
+    the nodes are relabeled with these names.
+
+    :param file: Location of the network file
+    :return: Tuple with file name and undirected NetworkX object
+    """
+    network = _READERS[os.path.splitext(file)[1]](file)
+    # need to make sure the graphml function does not arbitrarily assign node ID
+    first = next(iter(network.nodes), None)
+    if first is None:
+        logger.warning('One of the imported networks contains no nodes.')
+    elif network.nodes[first].get('name', first) != first:
+        names = nx.get_node_attributes(network, 'name')
+        try:
+            nx.relabel_nodes(network, names, copy=False)
+        except nx.NetworkXUnfeasible:
+            # names overlap with node IDs in a cycle, so this cannot be done in place
+            network = nx.relabel_nodes(network, names)
+    if network.is_directed():
+        # a copy instead of a view, so edges are not merged again on every lookup
+        network = network.to_undirected()
+    _edge_array(network)
+    return os.path.basename(file), network
+
+
+def _parse_number(value):
+    """
+    Converts a number given on the command line to an int or float.
+    Whole numbers are returned as int, so labels such as 'Intersection 1' do not change.
+
+    :param value: String or number
+    :return: Int or float
+    """
+    number = float(value)
+    if number.is_integer() and '.' not in str(value):
+        return int(number)
+    return number
+
+
+def _split_groups(data):
+    """
+    Splits a dataframe into a dictionary of dataframes per group.
+    Groups without rows are left out.
+
+    :param data: Pandas dataframe with a Group column
+    :return: Dictionary with group names as keys and dataframes as values
+    """
+    return {group: subset.copy() for group, subset in data.groupby('Group', sort=False)
+            if not subset.empty}
+
+
+def _save_frame(data, fp, fmt):
+    """
+    Writes a Pandas dataframe to a csv, parquet or feather file.
+    The columnar formats cannot store tuples,
+    so columns with lists of tuples are written as strings.
+
+    :param data: Pandas dataframe
+    :param fp: Filepath without extension
+    :param fmt: Output format: csv, parquet or feather
+    :return: Filepath with extension
+    """
+    fp += _EXTENSIONS[fmt]
+    if fmt == 'csv':
+        data.to_csv(fp)
+    else:
+        data = data.reset_index(drop=True)
+        for column in data.columns:
+            if data[column].map(lambda x: isinstance(x, (list, tuple))).any():
+                data[column] = data[column].map(str)
+        if fmt == 'parquet':
+            data.to_parquet(fp, compression='snappy')
+        else:
+            data.to_feather(fp)
+    return fp
+
+
+def _save_intersection(edges, fp):
+    """
+    Writes an intersection as a sparse adjacency matrix to an npz file.
+    The file can be read with scipy.sparse.load_npz;
+    the node names are stored in the same file under 'nodes'.
+    Edges have a value of 1, or their sign if the intersection takes sign information into account.
+
+    :param edges: List of edges returned by _intersection
+    :param fp: File path without extension
+    :return: File path
+    """
+    # scipy.sparse is only needed for this output format
+    from scipy.sparse import coo_matrix
+    index = dict()
+    rows = [index.setdefault(edge[0], len(index)) for edge in edges]
+    cols = [index.setdefault(edge[1], len(index)) for edge in edges]
+    values = [edge[2] if len(edge) == 3 else 1 for edge in edges]
+    # the matrix is symmetric, but self-loops should only be stored once
+    mirrored = [i for i in range(len(edges)) if rows[i] != cols[i]]
+    matrix = coo_matrix((values + [values[i] for i in mirrored],
+                         (rows + [cols[i] for i in mirrored], cols + [rows[i] for i in mirrored])),
+                        shape=(len(index), len(index))).tocsr()
+    fp = fp + '.npz'
+    np.savez_compressed(fp, data=matrix.data, indices=matrix.indices, indptr=matrix.indptr,
+                        format=np.array(b'csr'), shape=np.array(matrix.shape),
+                        nodes=np.array([str(node) for node in index]))
+    return fp
+
+
+def _save_frame_async(writer, writes, data, fp, fmt, name=None):
+    """
+    Queues a dataframe for writing with _save_frame in a thread pool.
+
+    :param writer: Thread pool
+    :param writes: List of pending writes
+    :param data: Pandas dataframe
+    :param fp: Filepath without extension
+    :param fmt: Output format: csv, parquet or feather
+    :param name: If given, the export is logged under this name once the file is written
+    :return:
+    """
+    writes.append((writer.apply_async(_save_frame, (data, fp, fmt)), name))
+
+
+def _finish_writes(writer, writes):
+    """
+    Waits until all queued dataframes are written.
+    If any of the writes failed, anuran exits with an error code,
+    so a run without its tables is not reported as completed.
+
+    :param writer: Thread pool
+    :param writes: List of pending writes
+    :return:
+    """
+    writer.close()
+    writer.join()
+    failed = False
+    for write, name in writes:
+        try:
+            fp = write.get()
+        except Exception:
+            logger.error('Could not write table!', exc_info=True)
+            failed = True
+            continue
+        if name:
+            logger.info(name + ' exported to: ' + fp)
+    if failed:
+        sys.exit(1)
+
+
 def model_calcs(networks, args):
     """
     Function for generating null models and carrying out calculations.
@@ -296,113 +494,161 @@ def model_calcs(networks, args):
     if args['core'] < 1:
         args['core'] = 1
         logger.info("Setting cores for multiprocessing to 1.")
-    # export intersections
-    for size in args['size']:
-        for group in networks:
-            shared_edges = _intersection(networks[group], float(size), sign=args['sign'], edgelist=True)
-            g = _construct_intersection(networks[group], shared_edges)
-            nx.write_graphml(g, args['fp'] + '_' + group + '_' + str(size) + '_intersection.graphml')
-    # first generate null models
-    try:
-        random, degree = generate_null(networks, n=args['perm'], npos=args['gperm'], core=args['core'], fraction=args['cs'],
-                                       prev=args['prev'])
-    except Exception:
-        logger.error('Could not generate null models!', exc_info=True)
-        sys.exit()
-    set_sizes = None
+    # sizes, core sizes and prevalences are parsed once instead of in every loop
+    args['size'] = [_parse_number(x) for x in args['size']]
+    if args['cs']:
+        args['cs'] = [_parse_number(x) for x in args['cs']]
+    if args['prev']:
+        args['prev'] = [_parse_number(x) for x in args['prev']]
+    fmt = args.get('format', 'csv')
+    # tables are written in background threads while the next steps run
+    writer = ThreadPool(4)
+    writes = list()
+    # queued tables are always written before returning,
+    # also when a step fails or the run exits early
     try:
-        set_sizes = generate_sizes(networks, random, degree, core=args['core'],
-                                   sign=args['sign'],
-                                   fractions=args['cs'], prev=args['prev'],
-                                   perm=args['nperm'], sizes=args['size'])
-        set_sizes.to_csv(args['fp'] + '_sets.csv')
-        set_differences = generate_size_differences(set_sizes, sizes=args['size'])
-        set_differences.to_csv(args['fp'] + '_set_differences.csv')
-        logger.info('Set sizes exported to: ' + args['fp'] + '_sets.csv')
-    except Exception:
-        logger.error('Failed to calculate set sizes!', exc_info=True)
-        sys.exit()
-    centralities = None
-    if args['centrality']:
-        try:
-            centralities = generate_ci_frame(networks, random, degree,
-                                             fractions=args['cs'], prev=args['prev'],
-                                             perm=args['nperm'], core=args['core'])
-            centralities.to_csv(args['fp'] + '_centralities.csv')
-            logger.info('Centralities exported to: ' + args['fp'] + '_centralities.csv')
-        except Exception:
-            logger.error('Could not rank centralities!', exc_info=True)
-            sys.exit()
-    if args['network']:
+        # export intersections
+        for group in networks:
+            intersections = _intersections(networks[group], args['size'], sign=args['sign'])
+            for size in args['size']:
+                fp = args['fp'] + '_' + group + '_' + str(size) + '_intersection'
+                if args.get('intersection_format') == 'npz':
+                    _save_intersection(intersections[size], fp)
+                else:
+                    g = _construct_intersection(networks[group], intersections[size])
+                    nx.write_graphml(g, fp + '.graphml')
+        # first generate null models
         try:
-            graph_properties = generate_graph_frame(networks, random, degree,
-                                                    fractions=args['cs'], core=args['prev'],
-                                                    perm=args['nperm'])
-            graph_properties.to_csv(args['fp'] + '_graph_properties.csv')
-            logger.info('Graph properties exported to: ' + args['fp'] + '_graph_properties.csv')
+            cache = args.get('cache_dir')
+            if cache:
+                logger.info('Null models and centralities are loaded from and stored in ' +
+                            os.path.abspath(cache) + '.')
+            random, degree = generate_null(networks, n=args['perm'], npos=args['gperm'], core=args['core'],
+                                           fraction=args['cs'], prev=args['prev'], cache=cache)
         except Exception:
-            logger.error('Could not estimate graph properties!', exc_info=True)
+            logger.error('Could not generate null models!', exc_info=True)
             sys.exit()
-    samples = None
-    if args['sample']:
+        # worker processes are shared by the set size, centrality and subsampling steps
+        workers = Pool(args['core'])
+        set_sizes = None
         try:
-            samples = generate_sample_sizes(networks, random, degree,
-                                            sign=args['sign'], core=args['core'],
-                                            fractions=args['cs'], perm=args['nperm'], prev=args['prev'],
-                                            sizes=args['size'], limit=args['sample'], number=args['number'])
-            samples.to_csv(args['fp'] + '_subsampled_sets.csv')
-            logger.info('Subsampled set sizes exported to: ' + args['fp'] + '_subsampled_sets.csv')
+            set_sizes = generate_sizes(networks, random, degree, core=args['core'],
+                                       sign=args['sign'], pool=workers,
+                                       fractions=args['cs'], prev=args['prev'],
+                                       perm=args['nperm'], sizes=args['size'])
+            _save_frame_async(writer, writes, set_sizes, args['fp'] + '_sets', fmt, name='Set sizes')
+            set_differences = generate_size_differences(set_sizes, sizes=args['size'])
+            _save_frame_async(writer, writes, set_differences, args['fp'] + '_set_differences', fmt)
         except Exception:
-            logger.error('Failed to subsample networks!', exc_info=True)
+            logger.error('Failed to calculate set sizes!', exc_info=True)
+            workers.close()
             sys.exit()
-    central_stats = None
-    if args['stats']:
+        centralities = None
+        if args['centrality']:
+            # optional steps import their modules only when they are run
+            from anuran.centrality import generate_ci_frame
+            try:
+                centralities = generate_ci_frame(networks, random, degree,
+                                                 fractions=args['cs'], prev=args['prev'],
+                                                 perm=args['nperm'], core=args['core'], cache=cache,
+                                                 pool=workers)
+                _save_frame_async(writer, writes, centralities, args['fp'] + '_centralities', fmt,
+                                  name='Centralities')
+            except Exception:
+                logger.error('Could not rank centralities!', exc_info=True)
+                workers.close()
+                sys.exit()
+        if args['network']:
+            from anuran.graphvals import generate_graph_frame
+            try:
+                graph_properties = generate_graph_frame(networks, random, degree,
+                                                        fractions=args['cs'], core=args['prev'],
+                                                        perm=args['nperm'])
+                _save_frame_async(writer, writes, graph_properties, args['fp'] + '_graph_properties', fmt,
+                                  name='Graph properties')
+            except Exception:
+                logger.error('Could not estimate graph properties!', exc_info=True)
+                workers.close()
+                sys.exit()
+        samples = None
+        if args['sample']:
+            try:
+                samples = generate_sample_sizes(networks, random, degree,
+                                                sign=args['sign'], core=args['core'],
+                                                fractions=args['cs'], perm=args['nperm'], prev=args['prev'],
+                                                sizes=args['size'], limit=args['sample'], number=args['number'],
+                                                pool=workers)
+                _save_frame_async(writer, writes, samples, args['fp'] + '_subsampled_sets', fmt,
+                                  name='Subsampled set sizes')
+            except Exception:
+                logger.error('Failed to subsample networks!', exc_info=True)
+                workers.close()
+                sys.exit()
+        workers.close()
+        central_stats = None
         if args['stats'] == 'True':
             args['stats'] = True
-        # add code for pvalue estimation
-        set_stats = compare_set_sizes(set_sizes)
-        set_stats.to_csv(args['fp'] + '_set_stats.csv')
-        difference_stats = compare_set_sizes(set_differences)
-        difference_stats.to_csv(args['fp'] + '_difference_stats.csv')
-        if args['centrality'] and centralities is not None:
-            central_stats = compare_centralities(centralities, mc=args['stats'])
-            central_stats.to_csv(args['fp'] + '_centrality_stats.csv')
-        if args['network']:
-            graph_stats = compare_graph_properties(graph_properties)
-            graph_stats.to_csv(args['fp'] + '_graph_stats.csv')
-    # check if there is an order in the filenames
-    for group in networks:
-        prefixes = [x[0].split('_')[0] for x in networks[group]]
-        try:
-            prefixes = [int(x) for x in prefixes]
-        except ValueError:
-            pass
-        if all(isinstance(x, int) for x in prefixes):
-            centrality_correlation = correlate_centralities(group, centralities, mc=args['stats'])
-            centrality_correlation.to_csv(args['fp'] + '_centrality_correlation.csv')
-            graph_correlation = correlate_graph_properties(group, graph_properties)
-            graph_correlation.to_csv(args['fp'] + '_centrality_correlation.csv')
-    if args['draw']:
-        try:
-            for x in networks:
-                subset_sizes = set_sizes[set_sizes['Group'] == x]
-                draw_sets(subset_sizes, args['fp'] + '_' + x)
-                subset_differences = set_differences[set_differences['Group'] == x]
-                draw_set_differences(subset_differences, args['fp'] + '_' + x)
+        # set sizes of groups with a single network cannot be compared
+        if args['stats'] and not any(len(networks[x]) >= 2 for x in networks):
+            logger.info('All groups contain a single network, skipping statistics.')
+        elif args['stats']:
+            from anuran.stats import compare_set_sizes, compare_centralities, compare_graph_properties
+            # add code for pvalue estimation
+            set_stats = compare_set_sizes(set_sizes)
+            _save_frame_async(writer, writes, set_stats, args['fp'] + '_set_stats', fmt)
+            difference_stats = compare_set_sizes(set_differences)
+            _save_frame_async(writer, writes, difference_stats, args['fp'] + '_difference_stats', fmt)
+            if args['centrality'] and centralities is not None:
+                central_stats = compare_centralities(centralities, mc=args['stats'])
+                _save_frame_async(writer, writes, central_stats, args['fp'] + '_centrality_stats', fmt)
+            if args['network']:
+                graph_stats = compare_graph_properties(graph_properties)
+                _save_frame_async(writer, writes, graph_stats, args['fp'] + '_graph_stats', fmt)
+        # check if there is an order in the filenames
+        for group in networks:
+            prefixes = [x[0].split('_')[0] for x in networks[group]]
+            if all(x.isdigit() for x in prefixes):
+                from anuran.stats import correlate_centralities, correlate_graph_properties
+                if centralities is not None:
+                    centrality_correlation = correlate_centralities(group, centralities, mc=args['stats'])
+                    _save_frame_async(writer, writes, centrality_correlation,
+                                      args['fp'] + '_' + group + '_centrality_correlation', fmt)
+                if args['network']:
+                    graph_correlation = correlate_graph_properties(group, graph_properties)
+                    _save_frame_async(writer, writes, graph_correlation,
+                                      args['fp'] + '_' + group + '_graph_correlation', fmt)
+        if args['draw']:
+            from anuran.draw import draw_sets, draw_samples, draw_centralities, \
+                draw_graphs, draw_set_differences
+            try:
+                # each table is split by group once instead of filtered again for every group
+                by_sets = _split_groups(set_sizes)
+                by_differences = _split_groups(set_differences)
                 if args['centrality']:
-                    subset_centralities = centralities[centralities['Group'] == x]
-                    draw_centralities(subset_centralities, args['fp'] + '_' + x)
+                    by_centralities = _split_groups(centralities)
                 if args['sample']:
-                    subset_samples = samples[samples['Group'] == x]
-                    draw_samples(subset_samples, args['fp'] + '_' + x)
+                    by_samples = _split_groups(samples)
                 if args['network']:
-                    subset_graphs = graph_properties[graph_properties['Group'] == x]
-                    draw_graphs(subset_graphs, args['fp'] + '_' + x)
-        except Exception:
-            logger.error('Could not draw data!', exc_info=True)
-            sys.exit()
-    if central_stats is not None:
-        return central_stats
+                    by_graphs = _split_groups(graph_properties)
+                for x in networks:
+                    if x not in by_sets:
+                        continue
+                    draw_sets(by_sets[x], args['fp'] + '_' + x)
+                    if x in by_differences:
+                        draw_set_differences(by_differences[x], args['fp'] + '_' + x)
+                    if args['centrality'] and x in by_centralities:
+                        draw_centralities(by_centralities[x], args['fp'] + '_' + x)
+                    if args['sample'] and x in by_samples:
+                        draw_samples(by_samples[x], args['fp'] + '_' + x)
+                    if args['network'] and x in by_graphs:
+                        draw_graphs(by_graphs[x], args['fp'] + '_' + x)
+            except Exception:
+                logger.error('Could not draw data!', exc_info=True)
+                sys.exit()
+        if central_stats is not None:
+            return central_stats
+    finally:
+        _finish_writes(writer, writes)
 
 
 if __name__ == '__main__':
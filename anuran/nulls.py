@@ -17,8 +17,11 @@ __email__ = 'lisa.rottjers@kuleuven.be'
 __status__ = 'Development'
 __license__ = 'Apache 2.0'
 
-from anuran.utils import _generate_null_parallel, _get_union
+from anuran.utils import _generate_null_indexed, _init_null_worker, _get_union_size, _pack_network, \
+    _load_cache, _dump_cache, _store_edge_arrays
 import multiprocessing as mp
+import os
+from hashlib import blake2b
 
 import logging.handlers
 
@@ -26,7 +29,7 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
-def generate_null(networks, n, npos, core, fraction=False, prev=False):
+def generate_null(networks, n, npos, core, fraction=False, prev=False, cache=None):
     """
     This function takes a list of networks.
     For each network, a list with length n is generated,
@@ -40,6 +43,8 @@ def generate_null(networks, n, npos, core, fraction=False, prev=False):
     To generate the list through multiprocessing,
     a dictionary with arguments is generated
     and provided to a utility function.
+    If a cache directory is given, the permutations for each model are stored there,
+    so a later run with the same networks and settings only generates missing models.
 
     :param networks: List of input NetworkX objects
     :param n: Number of randomized networks per input network
@@ -47,6 +52,7 @@ def generate_null(networks, n, npos, core, fraction=False, prev=False):
     :param core: Number of processor cores
     :param fraction: Fraction of conserved interactions
     :param prev: Prevalence of core. If provided, null models have conserved interactions.
+    :param cache: Directory for storing generated null models
     :return: List of lists with randomized networks
     """
     all_results = {'random': {x: {'random': [], 'core': {}} for x in networks},
@@ -54,51 +60,80 @@ def generate_null(networks, n, npos, core, fraction=False, prev=False):
     # firt generate list of network models that need to be generated
     all_models = list()
     for x in networks:
-        for y in networks[x]:
-            all_models.append({'network': y,
-                               'networks': len(networks[x]),
-                               'name': x,
-                               'fraction': None,
-                               'prev': None,
-                               'n': n,
-                               'mode': 'random'})
-            all_models.append({'network': y,
-                               'networks': len(networks[x]),
-                               'name': x,
-                               'fraction': None,
-                               'prev': None,
-                               'n': n,
-                               'mode': 'degree'})
+        group = networks[x]
+        # model dictionaries only differ in a few values,
+        # so they are constructed from a template per group
+        template = {'networks': len(group), 'network': None, 'name': x,
+                    'fraction': None, 'prev': None, 'n': n}
+        for y in group:
+            all_models.append({**template, 'network': y, 'mode': 'random'})
+            all_models.append({**template, 'network': y, 'mode': 'degree'})
         if fraction:
+            # the union only depends on the group, not on the fraction
+            union_size = _get_union_size(group)
+            core_template = {**template, 'networks': group, 'n': npos}
             for frac in fraction:
                 all_results['random'][x]['core'][frac] = dict()
                 all_results['degree'][x]['core'][frac] = dict()
                 # report in logger the edge numbers
-                all_edges = _get_union(networks[x])
-                core_num = round(len(all_edges) * float(frac))
-                logger.info("The " + str(frac) + "core for network group " + x +
-                            " contains " + str(core_num) + " core edges out of " + str(all_edges) + "total.")
+                core_num = round(union_size * float(frac))
+                logger.info("The " + str(frac) + " core for network group " + x +
+                            " contains " + str(core_num) + " core edges out of " + str(union_size) + " total.")
                 for p in prev:
                     all_results['random'][x]['core'][frac][p] = list()
                     all_results['degree'][x]['core'][frac][p] = list()
-                    all_models.append({'networks': networks[x],
-                                       'network': None,
-                                       'name': x,
-                                       'fraction': frac,
-                                       'prev': p,
-                                       'n': npos,
-                                       'mode': 'random'})
-                    all_models.append({'networks': networks[x],
-                                       'network': None,
-                                       'name': x,
-                                       'fraction': frac,
-                                       'prev': p,
-                                       'n': npos,
-                                       'mode': 'degree'})
-    # run size inference in parallel
-    pool = mp.Pool(core)
-    results = pool.map(_generate_null_parallel, all_models)
-    pool.close()
+                    all_models.append({**core_template, 'fraction': frac, 'prev': p, 'mode': 'random'})
+                    all_models.append({**core_template, 'fraction': frac, 'prev': p, 'mode': 'degree'})
+    results = [None] * len(all_models)
+    cache_files = [None] * len(all_models)
+    if cache:
+        os.makedirs(cache, exist_ok=True)
+        for i, model in enumerate(all_models):
+            cache_files[i] = os.path.join(cache, _model_key(model) + '.pkl')
+            results[i] = _load_cache(cache_files[i])
+        logger.info('Loaded ' + str(sum(x is not None for x in results)) + ' of ' +
+                    str(len(all_models)) + ' null models from ' + cache + '.')
+    missing = [i for i in range(len(all_models)) if results[i] is None]
+    # permutations of a single model are split into batches,
+    # so the pool has enough tasks to keep all cores busy
+    # even if there are fewer models than cores
+    batches = -(-core // len(missing)) if missing else 1
+    tasks = list()
+    targets = list()
+    for i in missing:
+        model = all_models[i]
+        for size in _split_permutations(model['n'], batches):
+            task = dict(model)
+            task['n'] = size
+            tasks.append(task)
+            targets.append(i)
+    # longest tasks are dispatched first, so the pool does not wait on a single large model
+    # at the end; cost is estimated from the number of permutations and edges
+    order = sorted(range(len(tasks)), key=lambda i: -_task_cost(tasks[i]))
+    chunk = max(1, len(tasks) // (core * 4))
+    # networks are packed once and sent to each worker when the pool starts,
+    # so the tasks only contain keys instead of the networks themselves
+    packed = dict()
+    for task in tasks:
+        if task['network']:
+            task['network'] = _packed_network(task['network'], packed)
+        else:
+            task['networks'] = [_packed_network(network, packed) for network in task['networks']]
+    batch_results = [None] * len(tasks)
+    with mp.Pool(core, initializer=_init_null_worker, initargs=(packed,)) as pool:
+        for i, result, arrays in pool.imap_unordered(_generate_null_indexed,
+                                                     [(i, tasks[i]) for i in order], chunksize=chunk):
+            _store_edge_arrays(result[1], arrays)
+            batch_results[i] = result
+    # batches of the same model are merged in their original order
+    for i, result in zip(targets, batch_results):
+        if results[i] is None:
+            results[i] = (result[0], list(result[1]))
+        else:
+            results[i][1].extend(result[1])
+    if cache:
+        for i in missing:
+            _dump_cache(results[i], cache_files[i])
     for result in results:
         # the first tuple in the result section
         # contains the settings:
@@ -112,3 +147,70 @@ def generate_null(networks, n, npos, core, fraction=False, prev=False):
     return all_results['random'], all_results['degree']
 
 
+def _split_permutations(n, batches):
+    """
+    Splits a number of permutations into at most the specified number of batches.
+    The sizes of the batches differ by at most one.
+
+    :param n: Number of permutations
+    :param batches: Number of batches
+    :return: List of batch sizes
+    """
+    batches = max(1, min(n, batches))
+    return [n // batches + (1 if i < n % batches else 0) for i in range(batches)]
+
+
+def _packed_network(network, packed):
+    """
+    Returns the network tuple with the NetworkX object replaced by a key.
+    The packed network is stored under this key, so each network is only packed once.
+
+    :param network: Tuple with network name and NetworkX object
+    :param packed: Dictionary of packed networks
+    :return: Tuple with network name and key of packed network
+    """
+    key = id(network[1])
+    if key not in packed:
+        packed[key] = _pack_network(network[1])
+    return network[0], key
+
+
+def _task_cost(task):
+    """
+    Estimates the run time of a null model task from the number of permutations
+    and the number of edges that need to be randomized.
+    Degree-preserving models swap edges and are slower than random models.
+
+    :param task: Dictionary with values for generating null models
+    :return: Relative cost of the task
+    """
+    if task['network']:
+        edges = task['network'][1].number_of_edges()
+    else:
+        edges = sum(network[1].number_of_edges() for network in task['networks'])
+    cost = task['n'] * edges
+    if task['mode'] == 'degree':
+        cost *= 2
+    return cost
+
+
+def _model_key(model):
+    """
+    Hashes the settings and input networks of a null model,
+    so the generated permutations can be retrieved from a cache.
+    Networks are hashed by their name, nodes and weighted edges.
+
+    :param model: Dictionary with values for generating null models
+    :return: Hexadecimal digest
+    """
+    if model['network']:
+        networks = [model['network']]
+    else:
+        networks = model['networks']
+    content = [model['name'], model['fraction'], model['prev'], model['n'], model['mode']]
+    for network in networks:
+        content.append(network[0])
+        content.append(sorted(str(node) for node in network[1].nodes))
+        content.append(sorted(str(tuple(sorted((str(edge[0]), str(edge[1])))) + (edge[2],))
+                              for edge in network[1].edges(data='weight')))
+    return blake2b(repr(content).encode(), digest_size=16).hexdigest()
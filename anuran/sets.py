@@ -10,19 +10,25 @@ __license__ = 'Apache 2.0'
 import logging.handlers
 import pandas as pd
 import numpy as np
-import random
-from itertools import combinations
-from scipy.special import binom
+from itertools import combinations, product, chain
+try:
+    from math import comb
+except ImportError:
+    # math.comb is only available from Python 3.8 onwards
+    from scipy.special import comb as _comb
+
+    def comb(n, k):
+        return _comb(n, k, exact=True)
 import os
 import multiprocessing as mp
-from anuran.utils import _generate_rows
+from anuran.utils import _generate_rows, _edge_keys
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
 def generate_sizes(networks, random_models, degree_models, sign,
-                   core, fractions, prev, perm, sizes, combos=None):
+                   core, fractions, prev, perm, sizes, combos=None, pool=None):
     """
     This function carries out set operations on all networks provided in
     the network, random and degree lists.
@@ -49,28 +55,52 @@ def generate_sizes(networks, random_models, degree_models, sign,
     :param perm: Number of sets to take from null models
     :param sizes: Size of intersection to calculate. By default 1 (edge should be in all networks).
     :param combos: Dictionary of networks to combine per network
+    :param pool: Multiprocessing pool; if not given, a pool is started for this function
     :return: List of lists with set sizes
     """
-    # Create empty pandas dataframe
-    all_results = pd.DataFrame(columns=['Network', 'Group', 'Network type', 'Conserved fraction',
-                                        'Prevalence of conserved fraction',
-                                        'Set type', 'Set size', 'Set type (absolute)'])
+    # rows are collected first, so the dataframe only needs to be constructed once
+    rows = list()
+    own_pool = pool is None
+    if own_pool:
+        pool = mp.Pool(core)
     for x in networks:
         if combos:
             c = combos[x]
         else:
             c = None
-        combined_networks = _sample_combinations(combos=c, networks=networks,
-                                                 random_models=random_models, degree_models=degree_models,
-                                                 group=x, fractions=fractions, prev=prev, perm=perm, sign=sign,
-                                                 sizes=sizes)
-        # run size inference in parallel
-        pool = mp.Pool(core)
-        results = pool.map(_generate_rows, combined_networks)
+        # only the edge keys are needed for set sizes,
+        # so these are sent to the workers instead of the NetworkX objects
+        keys = _group_keys(networks[x], random_models[x], degree_models[x], sign)
+        combined_networks = ({**task, 'networks': [(network[0], keys[id(network[1])])
+                                                   for network in task['networks']]}
+                             for task in _iter_combinations(combos=c, networks=networks,
+                                                            random_models=random_models,
+                                                            degree_models=degree_models,
+                                                            group=x, fractions=fractions, prev=prev,
+                                                            perm=perm, sign=sign, sizes=sizes))
+        # tasks are generated while the pool runs, so the full work list is never stored;
+        # the chunk size is therefore based on the expected number of tasks
+        num_sets = 1 + 2 * perm
+        if fractions:
+            num_sets += 2 * len(fractions) * len(prev) * len(random_models[x]['core'][fractions[0]][prev[0]])
+        chunk = max(1, (len(c) if c is not None else 1) * num_sets // (core * 4))
+        # run size inference in parallel;
+        # results are consumed as they arrive, in the same order as the work list,
+        # so the first rows still belong to the input networks
+        for result in pool.imap(_generate_rows, combined_networks, chunksize=chunk):
+            rows.extend(result)
+    if own_pool:
         pool.close()
-        for result in results:
-            all_results = all_results.append(result, ignore_index=True, sort=False)
-    return all_results
+    all_results = pd.DataFrame.from_records(rows, columns=['Network', 'Group', 'Network type', 'Conserved fraction',
+                                                           'Prevalence of conserved fraction',
+                                                           'Set type', 'Set size', 'Set type (absolute)', 'Samples'])
+    # set sizes are counts and the string columns only contain a handful of distinct values;
+    # categories keep the order of appearance so figures still start with the input networks
+    dtypes = {'Set size': np.int32, 'Samples': np.int32}
+    # the absolute set type is missing for differences; categories cannot contain missing values
+    for column in ['Network', 'Group', 'Network type', 'Set type', 'Set type (absolute)']:
+        dtypes[column] = pd.CategoricalDtype(pd.unique(all_results[column].dropna()))
+    return all_results.astype(dtypes, copy=False)
 
 
 def generate_size_differences(data, sizes):
@@ -98,9 +128,8 @@ def generate_size_differences(data, sizes):
     :param sizes: Size of intersection to calculate. By default 1 (edge should be in all networks).
     :return: Dataframe with intersection intervals
     """
-    # Create empty pandas dataframe
-    intersection_differences = pd.DataFrame(columns=['Interval', 'Set size', 'Group',
-                                                     'Network'])
+    # rows are collected first, so the dataframe only needs to be constructed once
+    rows = list()
     for x in set(data['Group']):
         grouped_data = data[data['Group'] == x]
         for name in set(grouped_data['Network']):
@@ -115,59 +144,36 @@ def generate_size_differences(data, sizes):
             for i in range(len(sizes)):
                 interval_data = subdata[subdata['Set type'].str.contains(' ' + str(sizes[i]))]
                 intersections[sizes[i]] = interval_data['Set size']
+            row = {'Group': x,
+                   'Network': name,
+                   'Network type': networktype,
+                   'Conserved fraction': frac,
+                   'Prevalence of conserved fraction': prev}
             for i in range(len(sizes)):
                 if i == 0:
                     # this is the interval up to 1
                     for value in intersections[sizes[i]]:
-                        intersection_differences = intersection_differences.append({'Interval': str(sizes[i]) +
-                                                                                    '->' + str(1),
-                                                                                    'Set size': value,
-                                                                                    'Group': x,
-                                                                                    'Network': name,
-                                                                                    'Network type': networktype,
-                                                                                    'Conserved fraction': frac,
-                                                                                    'Prevalence of conserved fraction': prev},
-                                                                                   ignore_index=True)
+                        rows.append({**row, 'Interval': str(sizes[i]) + '->' + str(1), 'Set size': value})
                 elif i == len(sizes) - 1:
                     # this is the interval up to 1
                     for value in difference['Set size']:
-                        intersection_differences = intersection_differences.append({'Interval': str(0) +
-                                                                                    '->' + str(sizes[i]),
-                                                                                    'Set size': value,
-                                                                                    'Group': x,
-                                                                                    'Network': name,
-                                                                                    'Network type': networktype,
-                                                                                    'Conserved fraction': frac,
-                                                                                    'Prevalence of conserved fraction': prev},
-                                                                                   ignore_index=True,)
+                        rows.append({**row, 'Interval': str(0) + '->' + str(sizes[i]), 'Set size': value})
                     for value in intersections[sizes[i]]:
-                        intersection_differences = intersection_differences.append({'Interval': str(sizes[i]) +
-                                                                                    '->' + str(sizes[i-1]),
-                                                                                    'Set size': value,
-                                                                                    'Group': x,
-                                                                                    'Network': name,
-                                                                                    'Network type': networktype,
-                                                                                    'Conserved fraction': frac,
-                                                                                    'Prevalence of conserved fraction': prev},
-                                                                                   ignore_index=True)
+                        rows.append({**row, 'Interval': str(sizes[i]) + '->' + str(sizes[i-1]), 'Set size': value})
                 else:
                     for k in range(len(intersections[sizes[i]])):
-                        intersection_differences = intersection_differences.append({'Interval': str(sizes[i]) +
-                                                                                    '->' + str(sizes[i-1]),
-                                                                                    'Set size': intersections[sizes[i]].iloc[k] -
-                                                                                    intersections[sizes[i-1]].iloc[k],
-                                                                                    'Group': x,
-                                                                                    'Network': name,
-                                                                                    'Network type': networktype,
-                                                                                    'Conserved fraction': frac,
-                                                                                    'Prevalence of conserved fraction': prev},
-                                                                                   ignore_index=True)
+                        rows.append({**row, 'Interval': str(sizes[i]) + '->' + str(sizes[i-1]),
+                                     'Set size': intersections[sizes[i]].iloc[k] -
+                                     intersections[sizes[i-1]].iloc[k]})
+    intersection_differences = pd.DataFrame(rows, columns=['Interval', 'Set size', 'Group', 'Network',
+                                                           'Conserved fraction', 'Network type',
+                                                           'Prevalence of conserved fraction'])
     return intersection_differences
 
 
 def generate_sample_sizes(networks, random_models,
                           degree_models, sign,
-                          core, fractions, prev, perm, sizes, limit, number):
+                          core, fractions, prev, perm, sizes, limit, number, pool=None):
     """
     This function wraps the the generate_sizes function
     but it only gives a random subset of the input networks and null models.
@@ -184,6 +190,7 @@ def generate_sample_sizes(networks, random_models,
     :param sizes: Size of intersection to calculate. By default 1 (edge should be in all networks).
     :param limit: Maximum number of resamples.
     :param number: Sample number to test.
+    :param pool: Multiprocessing pool; if not given, a pool is started for this function
     :return: List of lists with set sizes
     """
     all_combinations = dict.fromkeys(networks.keys())
@@ -194,35 +201,91 @@ def generate_sample_sizes(networks, random_models,
             seq = range(1, len(networks[x])+1)
         all_combinations[x] = []
         for i in seq:
-            n = binom(len(networks[x]), i)
+            n = comb(len(networks[x]), i)
             max_num = n
             if type(limit) == int:
                 if limit < n:
                     n = limit
             # for sampling random numbers
-            # if the number of combinations is small enough,
+            # if all combinations are needed,
             # we can use the iterator
             # if not, better to sample networks randomly
-            # gives possibility of duplicates
-            # however, better than having to store huge iterator as list
+            # instead of storing the huge iterator as list
             if max_num == n:
                 combos = list(combinations(range(len(networks[x])), i))
             else:
-                combos = list()
-                for j in range(n):
-                    combos.append(random.sample(range(len(networks[x])), i))
+                combos = _random_combinations(len(networks[x]), i, n, max_num)
             all_combinations[x].extend(combos)
     results = generate_sizes(networks=networks, random_models=random_models, degree_models=degree_models, sign=sign,
                              core=core, fractions=fractions,
-                             prev=prev, perm=perm, sizes=sizes, combos=all_combinations)
+                             prev=prev, perm=perm, sizes=sizes, combos=all_combinations, pool=pool)
     return results
 
 
-def _sample_combinations(networks, random_models, degree_models, group, fractions, prev, perm, sign, sizes, combos=None):
+def _random_combinations(total, size, number, max_num):
+    """
+    Samples distinct combinations of networks without listing all possible combinations.
+    Combinations are drawn at random and duplicates are rejected;
+    if most combinations are needed, rejection would be slow,
+    so distinct ranks of combinations are drawn and converted to combinations instead.
+
+    :param total: Number of networks
+    :param size: Number of networks per combination
+    :param number: Number of combinations to sample
+    :param max_num: Number of possible combinations
+    :return: List of combinations
+    """
+    rng = np.random.default_rng()
+    if number * 2 > max_num:
+        # max_num is below twice the number of samples here, so ranks fit in an integer array
+        ranks = rng.choice(max_num, number, replace=False)
+        return [_unrank_combination(int(rank), total, size) for rank in ranks]
+    seen = set()
+    combos = list()
+    while len(combos) < number:
+        # the remaining combinations are drawn at once:
+        # the positions of the smallest random values in each row form a combination
+        draws = np.argpartition(rng.random((number - len(combos), total)), size - 1, axis=1)[:, :size]
+        for combo in np.sort(draws, axis=1).tolist():
+            combo = tuple(combo)
+            if combo not in seen:
+                seen.add(combo)
+                combos.append(combo)
+    return combos
+
+
+def _unrank_combination(rank, total, size):
+    """
+    Returns the combination with the given rank
+    in the lexicographic order of all combinations of a number of networks,
+    i.e. the same order as itertools.combinations.
+
+    :param rank: Rank of the combination
+    :param total: Number of networks
+    :param size: Number of networks per combination
+    :return: Tuple with network indices
+    """
+    combo = list()
+    start = 0
+    for k in range(size, 0, -1):
+        # skip all combinations that start with a lower index than the next one
+        while True:
+            skipped = comb(total - start - 1, k - 1)
+            if rank < skipped:
+                break
+            rank -= skipped
+            start += 1
+        combo.append(start)
+        start += 1
+    return tuple(combo)
+
+
+def _iter_combinations(networks, random_models, degree_models, group, fractions, prev, perm, sign, sizes, combos=None):
     """
     This function generates an iterable containing all information required
     to add new rows to a pandas dataframe.
     This iterable can then be supplied to a multiprocessing pool to speed up calculations.
+    Tasks are yielded one at a time, so the full work list does not need to be stored.
 
     :param combos: List of networks to combine
     :param networks: List of networks belonging to group x
@@ -234,68 +297,98 @@ def _sample_combinations(networks, random_models, degree_models, group, fraction
     :param perm: Number of sets to take from null models
     :param sign: If true, sets take sign information into account.
     :param sizes: Size of intersection to calculate. By default 1 (edge should be in all networks).
-    :return:
+    :return: Generator of dictionaries with values for new rows
     """
-    all_networks = list()
-    if not combos:
-        combos = [tuple([network for network in range(len(networks[group]))])]
+    rng = np.random.default_rng()
+    # values that do not change between combinations are only looked up once;
+    # all sets report the group by its base name, as in the centrality and graph property frames
+    group_name = os.path.basename(group)
+    group_networks = networks[group]
+    group_random = random_models[group]
+    group_degree = degree_models[group]
+    if fractions:
+        num_models = len(group_random['core'][fractions[0]][prev[0]])
+        randomcore = _core_array(group_random['core'], fractions, prev, num_models, len(group_networks))
+        degreecore = _core_array(group_degree['core'], fractions, prev, num_models, len(group_networks))
+    # task dictionaries only differ in a few values,
+    # so they are constructed from templates
+    template = {'group': group_name, 'sizes': sizes, 'sign': sign}
+    null_template = {**template, 'fraction': None, 'prev': np.nan}
+    if combos is None:
+        # by default, the set contains all networks in the group;
+        # an empty list of combinations means there are no sets to sample
+        combos = [tuple(range(len(group_networks)))]
     for item in combos:
-        subnetworks = [networks[group][y] for y in item]
-        all_networks.append({'networks': subnetworks,
-                             'name': 'Input',
-                             'group': group,
-                             'sizes': sizes,
-                             'sign': sign,
-                             'fraction': None,
-                             'prev': None})
-        subrandom = {'random': [random_models[group]['random'][y] for y in item]}
-        subdegree = {'degree': [degree_models[group]['degree'][y] for y in item]}
+        num_networks = len(item)
+        subnetworks = [group_networks[y] for y in item]
+        yield {**template, 'networks': subnetworks, 'name': 'Input', 'fraction': None, 'prev': None}
+        subrandom = {'random': [group_random['random'][y] for y in item]}
+        subdegree = {'degree': [group_degree['degree'][y] for y in item]}
+        # the permutations for all sets are picked at once;
+        # picks are converted to lists, since indexing with NumPy integers is slower
+        degreepicks = rng.integers(0, [len(models) for models in subdegree['degree']],
+                                   size=(perm, num_networks)).tolist()
+        randompicks = rng.integers(0, [len(models) for models in subrandom['random']],
+                                   size=(perm, num_networks)).tolist()
         for j in range(perm):
-            degreeperm = [random.sample(subdegree['degree'][r], 1)[0] for r in range(len(subdegree['degree']))]
-            all_networks.append({'networks': degreeperm,
-                                 'name': 'Degree',
-                                 'group': os.path.basename(group),
-                                 'sizes': sizes,
-                                 'sign': sign,
-                                 'fraction': None,
-                                 'prev': np.nan})
-            randomperm = [random.sample(subrandom['random'][r], 1)[0] for r in range(len(subrandom['random']))]
-            all_networks.append({'networks': randomperm,
-                                 'name': 'Random',
-                                 'group': group,
-                                 'sizes': sizes,
-                                 'sign': sign,
-                                 'fraction': None,
-                                 'prev': np.nan})
-        subrandom['core'] = {}
-        subdegree['core'] = {}
+            degreeperm = [models[pick] for models, pick in zip(subdegree['degree'], degreepicks[j])]
+            yield {**null_template, 'networks': degreeperm, 'name': 'Degree'}
+            randomperm = [models[pick] for models, pick in zip(subrandom['random'], randompicks[j])]
+            yield {**null_template, 'networks': randomperm, 'name': 'Random'}
         if fractions:
-            num_models = len(random_models[group]['core'][fractions[0]][prev[0]])
-            for frac in fractions:
-                subrandom['core'][frac] = dict()
-                subdegree['core'][frac] = dict()
-                for c in prev:
-                    subrandom['core'][frac][c] = list()
-                    subdegree['core'][frac][c] = list()
-                    for n in range(num_models):
-                        degreeperm = degree_models[group]['core'][frac][c][n]
-                        degreeperm = [degreeperm[y] for y in item]
-                        all_networks.append({'networks': degreeperm,
-                                             'name': 'Degree',
-                                             'group': group,
-                                             'sizes': sizes,
-                                             'sign': sign,
-                                             'fraction': frac,
-                                             'prev': c})
-                        randomperm = random_models[group]['core'][frac][c][n]
-                        randomperm = [randomperm[y] for y in item]
-                        all_networks.append({'networks': randomperm,
-                                             'name': 'Random',
-                                             'group': group,
-                                             'sizes': sizes,
-                                             'sign': sign,
-                                             'fraction': frac,
-                                             'prev': c})
-    return all_networks
+            # one indexing operation selects the networks of this combination
+            # from all positive control models
+            subrandom['core'] = randomcore[:, :, :, list(item)]
+            subdegree['core'] = degreecore[:, :, :, list(item)]
+            for (f, frac), (p, c), n in product(enumerate(fractions), enumerate(prev), range(num_models)):
+                core_template = {**template, 'fraction': frac, 'prev': c}
+                yield {**core_template, 'networks': list(subdegree['core'][f, p, n]), 'name': 'Degree'}
+                yield {**core_template, 'networks': list(subrandom['core'][f, p, n]), 'name': 'Random'}
+
+
+def _core_array(models, fractions, prev, num_models, num_networks):
+    """
+    Places the positive control models of a group in a NumPy object array,
+    so the models for a combination of networks can be selected
+    for all fractions, prevalences and permutations at once.
+    The array has the following dimensions:
+    fractions, prevalences, permutations, networks.
+
+    :param models: Dictionary with positive control models per fraction and prevalence
+    :param fractions: List with fractions of shared interactions
+    :param prev: List with prevalence of shared interactions
+    :param num_models: Number of permutations per fraction and prevalence
+    :param num_networks: Number of networks in the group
+    :return: Object array with network tuples
+    """
+    array = np.empty((len(fractions), len(prev), num_models, num_networks), dtype=object)
+    for f, frac in enumerate(fractions):
+        for p, c in enumerate(prev):
+            for n in range(num_models):
+                for y in range(num_networks):
+                    # tuples are assigned per element, otherwise NumPy would unpack them
+                    array[f, p, n, y] = models[frac][c][n][y]
+    return array
 
 
+def _group_keys(networks, random_models, degree_models, sign):
+    """
+    Packs the edges of all input networks and null models of a group into int64 keys.
+    Nodes are indexed across the whole group,
+    so the keys of any combination of these networks can be compared.
+
+    :param networks: List of input networks in the group
+    :param random_models: Dictionary with permuted networks without preserved degree distribution
+    :param degree_models: Dictionary with permuted networks with preserved degree distribution
+    :param sign: If true, the sign of the edge weight is part of the key.
+    :return: Dictionary with sorted array of keys per id of NetworkX object
+    """
+    graphs = dict()
+    permutations = random_models['random'] + degree_models['degree']
+    for models in (random_models['core'], degree_models['core']):
+        for frac in models:
+            for c in models[frac]:
+                permutations.extend(models[frac][c])
+    for network in chain(networks, *permutations):
+        graphs.setdefault(id(network[1]), network)
+    return dict(zip(graphs, _edge_keys(list(graphs.values()), sign)[0]))
@@ -45,7 +45,7 @@ def correlate_centralities(group, centralities, mc):
     :param mc: multiple-testing correction
     :return: Dataframe of correlations
     """
-    statsframe = pd.DataFrame(columns=['Node', 'Network', 'Group', 'Measure', 'Spearman rho', 'P'])
+    rows = list()
     subcentralities = centralities[centralities['Group'] == group]
     for index, row in subcentralities.iterrows():
         ordered_values = sorted(row['Values'], key=lambda x: int(x[0].split("_")[0]))
@@ -57,7 +57,8 @@ def correlate_centralities(group, centralities, mc):
                  'Measure': row['Centrality'],
                  'Spearman rho': rho,
                  'P': p}
-        statsframe = statsframe.append(stats, ignore_index=True)
+        rows.append(stats)
+    statsframe = pd.DataFrame(rows, columns=['Node', 'Network', 'Group', 'Measure', 'Spearman rho', 'P'])
     # multiple testing correction
     if type(mc) == str and len(statsframe) > 0:
         # first separate statsframe
@@ -80,14 +81,16 @@ def correlate_graph_properties(group, graph_properties):
     :param graph_properties: Dataframe with graph properties
     :return: Dataframe of correlations
     """
-    statsframe = pd.DataFrame(columns=['Network', 'Group', 'Measure', 'Spearman rho', 'P'])
+    rows = list()
     subproperties = graph_properties[graph_properties['Group'] == group]
     for network in set(subproperties['Network']):
         networkproperties = subproperties[subproperties['Network'] == network]
         for property in set(subproperties['Property']):
             networkproperty = networkproperties[networkproperties['Property'] == property]
-            ordered_names = sorted(networkproperty['Name'], key=lambda x: int(x.split("_")[0]))
-            ordered_values = [float(networkproperty[networkproperty['Name'] == x]['Value']) for x in ordered_names]
+            ordered_names = sorted(set(networkproperty['Name']), key=lambda x: int(x.split("_")[0]))
+            # null models have a value for each permutation of a network, so these are averaged
+            mean_values = networkproperty.groupby('Name')['Value'].mean()
+            ordered_values = [float(mean_values[x]) for x in ordered_names]
             values = [x for x in ordered_values if not np.isnan(x)]
             rho, p = spearmanr(list(range(len(values))), values)
             stats = {'Network': networkproperty["Network"].iloc[0],
@@ -95,7 +98,8 @@ def correlate_graph_properties(group, graph_properties):
                      'Measure': property,
                      'Spearman rho': rho,
                      'P': p}
-            statsframe = statsframe.append(stats, ignore_index=True)
+            rows.append(stats)
+    statsframe = pd.DataFrame(rows, columns=['Network', 'Group', 'Measure', 'Spearman rho', 'P'])
     statsframe = statsframe.sort_values('P')
     return statsframe
 
@@ -120,7 +124,8 @@ def compare_centralities(centralities, mc):
     :param mc: Method for multiple-testing correction
     :return: pandas dataframe with p-values for comparisons
     """
-    statsframe = pd.DataFrame(columns=['Node', 'Group', 'Comparison', 'Measure', 'P', 'P.type'])
+    # rows are collected as dictionaries and converted to a dataframe once
+    rows = list()
     # first do comparison to null models
     for group in set(centralities['Group']):
         groupset = centralities[centralities['Group'] == group]
@@ -129,21 +134,22 @@ def compare_centralities(centralities, mc):
         nulls = groupset[groupset['Network type'] != 'Input networks']
         for op in set(orig['Centrality']):
             orig_values = orig[orig['Centrality'] == op]
+            orig_ranges = _values_per_node(orig_values)
             all_null_values = nulls[nulls['Centrality'] == op]
             # we construct a value range from each network type
             for nulltype in ['Random', 'Degree']:
-                null_values = all_null_values[all_null_values['Network'] == nulltype]
+                null_ranges = _values_per_node(all_null_values[all_null_values['Network'] == nulltype])
                 for node in orig_values['Node']:
-                    range_1 = [x[1] for x in orig_values[orig_values['Node'] == node]['Values'].iloc[0] if x]
+                    range_1 = [x[1] for x in orig_ranges[node][0] if x]
                     range_2 = list()
-                    if len(null_values[null_values['Node'] == node]) > 0:
+                    if node in null_ranges:
                         # there are nperm ranges for each node
                         # since the randomized models are resampled n times
                         # so we get a permutation statistic: number of permutations
                         # with different centralities from null
                         utest = list()
-                        for k in range(len(null_values[null_values['Node'] == node]['Values'])):
-                            range_2 = [x[1] for x in null_values[null_values['Node'] == node]['Values'].iloc[k] if x]
+                        for values in null_ranges[node]:
+                            range_2 = [x[1] for x in values if x]
                         # nodes that are in original networks may not be in randomized networks
                             if len(range_1) > 5 and len(range_2) > 5:
                                 # comparison is likely to return strange results if there are not enough observations
@@ -153,8 +159,8 @@ def compare_centralities(centralities, mc):
                                     utest.append(mannwhitneyu(range_1, range_2)[1])
                         if len(utest) > 0:
                             p = 1 - (1 / (len(utest)+1) * (len([x for x in utest if x < 0.05])+1))
-                            statsframe = _generate_stat_rows(statsframe, node=node, group=group, comparison=nulltype,
-                                                             operation=op, p=p, ptype='Mann-Whitney')
+                            rows.append(_stat_row(node=node, group=group, comparison=nulltype,
+                                                  operation=op, p=p, ptype='Mann-Whitney'))
     combos = combinations(set(centralities['Group']), 2)
     for combo in combos:
         group1 = centralities[centralities['Group'] == combo[0]]
@@ -163,13 +169,14 @@ def compare_centralities(centralities, mc):
         group2 = group2[group2['Network'] == 'Input']
         for op in set(group1['Centrality']):
             group1_values = group1[group1['Centrality'] == op]
-            group2_values = group2[group2['Centrality'] == op]
+            group1_ranges = _values_per_node(group1_values)
+            group2_ranges = _values_per_node(group2[group2['Centrality'] == op])
             for node in group1_values['Node']:
-                range_1 = [x for x in group1_values[group1_values['Node'] == node]['Values'].iloc[0] if x]
-                # we only need to access iloc 0 since there is one range per group
+                range_1 = [x for x in group1_ranges[node][0] if x]
+                # we only need to access the first range since there is one range per group
                 range_2 = list()
-                if len(group2_values[group2_values['Node'] == node]) > 0:
-                    range_2 = [x for x in group2_values[group2_values['Node'] == node]['Values'].iloc[0] if x]
+                if node in group2_ranges:
+                    range_2 = [x for x in group2_ranges[node][0] if x]
                     # nodes that are in original networks may not be in randomized networks
                 if len(range_1) > 5 and len(range_2) > 5:
                     # comparison is likely to return strange results if there are not enough observations
@@ -177,8 +184,9 @@ def compare_centralities(centralities, mc):
                     with catch_warnings():
                         simplefilter("ignore")
                         p = mannwhitneyu(range_1, range_2)
-                    statsframe = _generate_stat_rows(statsframe, node=node, group=combo[0], comparison=combo[1],
-                                                     operation=op, p=p[1], ptype='Mann-Whitney')
+                    rows.append(_stat_row(node=node, group=combo[0], comparison=combo[1],
+                                          operation=op, p=p[1], ptype='Mann-Whitney'))
+    statsframe = pd.DataFrame(rows, columns=['Node', 'Group', 'Comparison', 'Measure', 'P', 'P.type'])
     # multiple testing correction
     if type(mc) == str  and len(statsframe) > 0:
         # first separate statsframe
@@ -199,7 +207,7 @@ def compare_graph_properties(graph_properties):
     :param graph_properties: Dataframe with graph properties
     :return: pandas dataframe with p-values for comparisons
     """
-    statsframe = pd.DataFrame(columns=['Group', 'Comparison', 'Measure', 'P', 'P.type'])
+    rows = list()
     # first do comparison to null models
     for group in set(graph_properties['Group']):
         groupset = graph_properties[graph_properties['Group'] == group]
@@ -214,8 +222,7 @@ def compare_graph_properties(graph_properties):
                 null_values = all_null_values[all_null_values['Network'] == nulltype]
                 range_1 = [x for x in orig_values['Value'] if x]
                 utest = list()
-                for perm in set(null_values['iteration']):
-                    permvalues = null_values[null_values['iteration'] == perm]
+                for perm, permvalues in null_values.groupby('iteration'):
                     range_2 = [x for x in permvalues['Value'] if x]
                     if len(range_1) > 5 and len(range_2) > 5:
                         # comparison is likely to return strange results if there are not enough observations
@@ -225,8 +232,8 @@ def compare_graph_properties(graph_properties):
                             utest.append(mannwhitneyu(range_1, range_2)[1])
                 if len(utest) > 0:
                     p = 1 - (1 / (len(utest) + 1) * (len([x for x in utest if x < 0.05]) + 1))
-                    statsframe = _generate_stat_rows(statsframe, group=group, comparison=nulltype,
-                                                     operation=op, p=p, ptype='Mann-Whitney')
+                    rows.append(_stat_row(group=group, comparison=nulltype,
+                                          operation=op, p=p, ptype='Mann-Whitney'))
     combos = combinations(set(graph_properties['Group']), 2)
     for combo in combos:
         group1 = graph_properties[graph_properties['Group'] == combo[0]]
@@ -244,8 +251,9 @@ def compare_graph_properties(graph_properties):
                 with catch_warnings():
                     simplefilter("ignore")
                     p = mannwhitneyu(range_1, range_2)
-                statsframe = _generate_stat_rows(statsframe, group=combo[0], comparison=combo[1],
-                                                 operation=op, p=p[1], ptype='Mann-Whitney')
+                rows.append(_stat_row(group=combo[0], comparison=combo[1],
+                                      operation=op, p=p[1], ptype='Mann-Whitney'))
+    statsframe = pd.DataFrame(rows, columns=['Group', 'Comparison', 'Measure', 'P', 'P.type'])
     statsframe = statsframe.sort_values('P')
     return statsframe
 
@@ -271,7 +279,7 @@ def compare_set_sizes(set_sizes):
     :param set_sizes: Dataframe with set sizes
     :return: pandas dataframe with p-values for comparisons
     """
-    statsframe = pd.DataFrame(columns=['Group', 'Comparison', 'Measure', 'P', 'P.type'])
+    rows = list()
     if 'Set type' in set_sizes.columns:
         property = 'Set type'
     else:
@@ -288,8 +296,7 @@ def compare_set_sizes(set_sizes):
             # we construct a value range from each network type
             for nulltype in set(op_nulls['Network']):
                 vals = op_nulls[op_nulls['Network'] == nulltype]['Set size']
-                if not np.all(vals == 0)\
-                        and not np.all([elem == list(vals)[0] for elem in vals]):
+                if not np.all(vals == 0) and len(np.unique(vals)) > 1:
                     # usually, core models do not follow a normal distribution
                     # hence, the normal test does not check models with a core
                     with catch_warnings():
@@ -302,23 +309,23 @@ def compare_set_sizes(set_sizes):
                             logger.warning('The values do not appear to follow a normal distribution '
                                            'for model: ' + nulltype + ' and set: ' + op)
                     p = _value_outside_range(size, vals)
-                    statsframe = _generate_stat_rows(statsframe, group=group, comparison=nulltype,
-                                                     operation=op, p=p, ptype='Set sizes')
+                    rows.append(_stat_row(group=group, comparison=nulltype,
+                                          operation=op, p=p, ptype='Set sizes'))
+    statsframe = pd.DataFrame(rows, columns=['Group', 'Comparison', 'Measure', 'P', 'P.type'])
     statsframe = statsframe.sort_values('P')
     return statsframe
 
 
-def _generate_stat_rows(data, group, comparison, operation, p, ptype, node=None):
+def _stat_row(group, comparison, operation, p, ptype, node=None):
     """
-    Generates dictionaries with necessary data for the pandas dataframes.
-    :param data: Pandas data
+    Generates a dictionary with the data for a single row of a statistics dataframe.
     :param group: Name for grouping NetworkX objects
     :param comparison: Network name of comparison
     :param operation: Difference and/or intersection
     :param p: p value
     :param ptype: Type of graph property that is being compared
     :param node: Name of node
-    :return: Pandas dataframe with new rows
+    :return: Dictionary with row data
     """
     new_row = {'Group': group,
                'Comparison': comparison,
@@ -327,8 +334,21 @@ def _generate_stat_rows(data, group, comparison, operation, p, ptype, node=None)
                'P.type': ptype}
     if node:
         new_row['Node'] = node
-    data = data.append(new_row, ignore_index=True)
-    return data
+    return new_row
+
+
+def _values_per_node(data):
+    """
+    Collects the centrality values of each node in a centrality dataframe,
+    so the values of a node can be looked up without filtering the dataframe.
+
+    :param data: Pandas dataframe with Node and Values columns
+    :return: Dictionary with nodes as keys and lists of values in order of the rows
+    """
+    values = dict()
+    for node, value in zip(data['Node'], data['Values']):
+        values.setdefault(node, list()).append(value)
+    return values
 
 
 def _value_outside_range(value, values):
@@ -341,7 +361,7 @@ def _value_outside_range(value, values):
     :param values: List of values
     :return: P
     """
-    if not np.all(values == 0) and not all(np.all(elem == list(values)[0] for elem in values)):
+    if not np.all(np.asarray(values) == 0) and len(np.unique(values)) > 1:
         std = np.std(values)
         z = (value - np.mean(values)) / std
         pval = norm.sf(abs(z))**2
@@ -352,20 +372,24 @@ def _value_outside_range(value, values):
 
 def _mc_correction(data, mc):
     """
-    Applies multiple-testing correction to a dataset generated with _generate_stat_rows.
+    Applies multiple-testing correction to a dataset with rows generated by _stat_row.
 
     :param data: Dataset with statistics results
     :param mc: Type of multiple testing correction
     :return: Dataset with added P.adj colum
     """
-    newframe = pd.DataFrame(columns=list(data.columns) + ['P.adj'])
+    frames = list()
+    # correlations are not compared to another group, but separated by network type
+    comparison = 'Comparison' if 'Comparison' in data.columns else 'Network'
     for property in set(data['Measure']):
         subframe = data[data['Measure'] == property].copy()
         # also separate per null model
-        for model in set(data['Comparison']):
+        for model in set(data[comparison]):
             if not (model == 'Degree' and property == 'Degree'):
-                subsubframe = subframe[subframe['Comparison'] == model].copy()
+                subsubframe = subframe[subframe[comparison] == model].copy()
                 p_adjusted = multipletests(subsubframe['P'], method=mc)[1]
                 subsubframe['P.adj'] = p_adjusted
-                newframe = newframe.append(subsubframe, ignore_index=True)
-    return newframe
\ No newline at end of file
+                frames.append(subsubframe)
+    if not frames:
+        return pd.DataFrame(columns=list(data.columns) + ['P.adj'])
+    return pd.concat(frames, ignore_index=True)
\ No newline at end of file
@@ -9,15 +9,86 @@ __status__ = 'Development'
 __license__ = 'Apache 2.0'
 
 import networkx as nx
-import pandas as pd
 from random import sample
+from itertools import chain
 import numpy as np
+from scipy.stats import rankdata
 import logging.handlers
-from copy import deepcopy
+import os
+import pickle
+import tempfile
+import weakref
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# edge arrays are cached per NetworkX object;
+# weak references let the cache entries disappear together with the networks
+_edge_arrays = weakref.WeakKeyDictionary()
+
+# NetworKit is optional; if it is available,
+# closeness and betweenness are calculated with its C++ implementation.
+# It is imported on first use, since importing it takes longer than anuran's other imports.
+_nk_module = list()
+
+
+def _load_cache(fp):
+    """
+    Loads an object from a cache file.
+    Files that are missing or cannot be read, e.g. because writing them was interrupted,
+    are treated as if they were not in the cache; unreadable files are removed.
+
+    :param fp: Path to cache file
+    :return: Cached object, or None if the file is missing or unreadable
+    """
+    if not os.path.isfile(fp):
+        return None
+    try:
+        with open(fp, 'rb') as file:
+            return pickle.load(file)
+    except (EOFError, pickle.UnpicklingError, OSError):
+        logger.warning('Could not read cache file ' + fp + ', it will be generated again.')
+        try:
+            os.remove(fp)
+        except OSError:
+            pass
+        return None
+
+
+def _dump_cache(obj, fp):
+    """
+    Writes an object to a cache file.
+    The object is first written to a temporary file in the same directory,
+    which then replaces the cache file, so an interrupted run cannot leave a partial file.
+
+    :param obj: Object to cache
+    :param fp: Path to cache file
+    :return:
+    """
+    handle, tmp = tempfile.mkstemp(dir=os.path.dirname(fp) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as file:
+            pickle.dump(obj, file)
+        os.replace(tmp, fp)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def _networkit():
+    """
+    Imports NetworKit the first time it is needed.
+
+    :return: NetworKit module, or None if it is not installed
+    """
+    if not _nk_module:
+        try:
+            import networkit
+            _nk_module.append(networkit)
+        except ImportError:
+            _nk_module.append(None)
+    return _nk_module[0]
+
 
 def _generate_null_parallel(values):
     """
@@ -48,6 +119,12 @@ def _generate_null_parallel(values):
         mode = values['mode']
     except KeyError:
         logger.error('Could not unpack dictionary!', exc_info=True)
+    # networks are sent to the worker as packed arrays
+    if network and not isinstance(network[1], nx.Graph):
+        network = (network[0], _unpack_network(network[1]))
+    if networks and not network:
+        networks = [(x[0], _unpack_network(x[1])) if not isinstance(x[1], nx.Graph) else x
+                    for x in networks]
     timeout = []
     preserve_deg = []
     if network:
@@ -74,6 +151,42 @@ def _generate_null_parallel(values):
     return params, nulls
 
 
+_packed_networks = dict()
+
+
+def _init_null_worker(packed):
+    """
+    Stores packed networks in each worker process,
+    so null model tasks only need to refer to them by key.
+
+    :param packed: Dictionary of packed networks
+    :return:
+    """
+    global _packed_networks
+    _packed_networks = packed
+
+
+def _generate_null_indexed(task):
+    """
+    Wraps _generate_null_parallel for unordered multiprocessing,
+    returning the index of the task together with the result.
+    Networks given as keys are looked up in the packed networks of the worker.
+
+    The edge arrays of the null models are computed here as well, so this happens in parallel;
+    they are returned separately, since the cache of _edge_array is not sent along with the networks.
+
+    :param task: Tuple with task index and dictionary containing values for generating null models
+    :return: Task index, tuple with settings and randomized networks, list of edge arrays
+    """
+    values = dict(task[1])
+    if values['network']:
+        values['network'] = (values['network'][0], _packed_networks[values['network'][1]])
+    else:
+        values['networks'] = [(x[0], _packed_networks[x[1]]) for x in values['networks']]
+    result = _generate_null_parallel(values)
+    return task[0], result, [_edge_array(network) for network in _null_graphs(result[1])]
+
+
 def _generate_positive_control(networks, fraction, prev, n, mode):
     """
     Generates n positive control models across the group of supplied networks.
@@ -123,10 +236,12 @@ def _generate_positive_control(networks, fraction, prev, n, mode):
 def _generate_negative_control(network, n, mode):
     nulls = list()
     timeout = False
+    if mode == 'random':
+        # random models without core edges share their setup,
+        # so all permutations are generated together
+        return [(network[0], null) for null in _random_networks(network[1], n)]
     for j in range(n):
-        if mode == 'random':
-            nulls.append((network[0], _randomize_network(network[1], keep=[])))
-        elif mode == 'degree':
+        if mode == 'degree':
             deg = _randomize_dyads(network[1], keep=[], timeout=timeout)
             nulls.append((network[0], deg[0]))
             timeout = deg[1]
@@ -147,13 +262,62 @@ def _generate_centralities_parallel(model_list):
     """
     centrality_list = []
     for network in model_list:
+        if _networkit():
+            degree, closeness, betweenness = _nk_centralities(network[1])
+        else:
+            degree = nx.degree_centrality(network[1])
+            closeness = nx.closeness_centrality(network[1])
+            betweenness = nx.betweenness_centrality(network[1])
         centrality_list.append((network[0], network[1],
-                                {'Degree': _centrality_percentile(nx.degree_centrality(network[1])),
-                                 'Closeness': _centrality_percentile(nx.closeness_centrality(network[1])),
-                                 'Betweenness': _centrality_percentile(nx.betweenness_centrality(network[1]))}))
+                                {'Degree': _centrality_percentile(degree),
+                                 'Closeness': _centrality_percentile(closeness),
+                                 'Betweenness': _centrality_percentile(betweenness)}))
     return centrality_list
 
 
+def _nx_to_nk(network):
+    """
+    Converts a NetworkX object to an unweighted NetworKit graph.
+    NetworKit uses integer node IDs, so the node list is returned as well
+    to map the NetworKit indices back to the original node names.
+
+    :param network: NetworkX object
+    :return: Tuple of NetworKit graph and list of nodes
+    """
+    nk = _networkit()
+    nodes = list(network.nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    graph = nk.Graph(len(nodes), directed=False)
+    for edge in network.edges:
+        graph.addEdge(index[edge[0]], index[edge[1]])
+    return graph, nodes
+
+
+def _nk_centralities(network):
+    """
+    Calculates degree, closeness and betweenness centrality with NetworKit.
+    The NetworkX object is only converted once and all centralities are read from the NetworKit graph.
+    The generalized closeness matches the NetworkX closeness centrality
+    for disconnected graphs.
+
+    :param network: NetworkX object
+    :return: Dictionaries with nodes as keys and centralities as values
+    """
+    nk = _networkit()
+    graph, nodes = _nx_to_nk(network)
+    if len(nodes) == 0:
+        return dict(), dict(), dict()
+    # same normalization as the NetworkX degree centrality
+    if len(nodes) > 1:
+        scale = 1 / (len(nodes) - 1)
+        degree = [graph.degree(i) * scale for i in range(len(nodes))]
+    else:
+        degree = [1]
+    closeness = nk.centrality.Closeness(graph, True, nk.centrality.ClosenessVariant.Generalized).run().scores()
+    betweenness = nk.centrality.Betweenness(graph, normalized=True).run().scores()
+    return dict(zip(nodes, degree)), dict(zip(nodes, closeness)), dict(zip(nodes, betweenness))
+
+
 def _centrality_percentile(centrality):
     """
     Given a dictionary of centralities, this function returns the percentile score of
@@ -163,9 +327,11 @@ def _centrality_percentile(centrality):
     :return:
     """
     if len(centrality) > 0:
-        ranking = pd.DataFrame.from_dict(centrality, orient='index')
-        ranking['rank'] = ranking[0].rank(pct=True)
-        ranking = ranking['rank'].to_dict()
+        # average ranks divided by the number of nodes,
+        # identical to the pandas percentile rank
+        nodes = list(centrality)
+        values = np.fromiter(centrality.values(), dtype=np.float64, count=len(nodes))
+        ranking = dict(zip(nodes, (rankdata(values) / len(values)).tolist()))
     else:
         ranking = None
     return ranking
@@ -193,16 +359,72 @@ def _randomize_network(network, keep):
         for edge in null.edges:
             randomized_weights.pop(edge, None)
     randomized_weights = sample(list(randomized_weights.values()), len(randomized_weights))
+    # sampling from the node view would copy it on every draw
+    nodes = list(null.nodes)
     for edge in range(num):
         created = False
         while not created:
-            new_edge = sample(null.nodes, 2)
+            new_edge = sample(nodes, 2)
             if new_edge not in null.edges:
                 null.add_edge(new_edge[0], new_edge[1], weight=randomized_weights[edge])
                 created = True
     return null
 
 
+def _random_networks(network, n):
+    """
+    Returns n networks with the same nodes and edge number as the input network,
+    with each edge placed randomly.
+    This gives the same models as _randomize_network without conserved edges,
+    but the edges are drawn at once as indices of node pairs.
+
+    :param network: NetworkX object
+    :param n: Number of networks to generate
+    :return: List of randomized networks
+    """
+    nodes = list(network.nodes)
+    num = network.number_of_edges()
+    weights = list(nx.get_edge_attributes(network, 'weight').values())
+    # node pairs (i, j) with i < j are numbered row by row
+    size = len(nodes)
+    total = size * (size - 1) // 2
+    nulls = list()
+    rng = np.random.default_rng()
+    for j in range(n):
+        pairs = rng.choice(total, num, replace=False)
+        first = size - 2 - np.floor(np.sqrt(8 * (total - pairs) - 7) / 2 - 0.5).astype(np.int64)
+        second = pairs + first + 1 - total + (size - first) * (size - first - 1) // 2
+        randomized_weights = [weights[k] for k in rng.permutation(len(weights)).tolist()]
+        null = nx.Graph()
+        null.add_nodes_from(nodes)
+        for k, (u, v) in enumerate(zip(first.tolist(), second.tolist())):
+            if k < len(randomized_weights):
+                null.add_edge(nodes[u], nodes[v], weight=randomized_weights[k])
+            else:
+                null.add_edge(nodes[u], nodes[v])
+        nulls.append(null)
+    return nulls
+
+
+def _index_pairs(rng, size, block):
+    """
+    Generates pairs of distinct indices for sampling two items from a list.
+    Indices are drawn in blocks with a NumPy generator,
+    instead of calling the random module for every pair.
+
+    :param rng: NumPy random generator
+    :param size: Length of the list
+    :param block: Number of pairs to draw at once
+    :return: Generator of index tuples
+    """
+    if size < 2:
+        raise ValueError('Sample larger than population or is negative')
+    while True:
+        for first, second in rng.integers(0, size, size=(max(block, 1), 2)).tolist():
+            if first != second:
+                yield first, second
+
+
 def _randomize_dyads(network, keep, timeout):
     """
     This function returns a network with the same nodes and edge number as the input network.
@@ -229,6 +451,10 @@ def _randomize_dyads(network, keep, timeout):
     else:
         maxcount = 10000000  # large number, but should allow deg model
     timeout = False
+    # sampling from the edge view would copy it on every draw,
+    # so swapped edges are tracked in a list instead
+    edges = list(null.edges)
+    draws = _index_pairs(np.random.default_rng(), len(edges), swaps)
     for swap in range(swaps):
         success = False
         count = 0
@@ -236,7 +462,8 @@ def _randomize_dyads(network, keep, timeout):
             # samples a set of nodes with swappable edges
             if count > maxcount:
                 timeout = True
-            dyad = sample(null.edges, 2)
+            indices = next(draws)
+            dyad = [edges[indices[0]], edges[indices[1]]]
             # samples two nodes that could have edges swapped
             if (dyad[0][0], dyad[1][0]) in null.edges:
                 count += 1
@@ -253,15 +480,14 @@ def _randomize_dyads(network, keep, timeout):
                 null.add_edge(dyad[0][1], dyad[1][1], weight=null.edges[dyad[1]]['weight'])
                 null.remove_edge(dyad[0][0], dyad[0][1])
                 null.remove_edge(dyad[1][0], dyad[1][1])
+                edges[indices[0]] = (dyad[0][0], dyad[1][0])
+                edges[indices[1]] = (dyad[0][1], dyad[1][1])
                 success = True
     preserve_deg = True
     if keep:
         # need weightless_keep to check if neighbour
         # is in core network
-        if len(keep[0]) == 3:
-            weightless_keep = [(edge[0], edge[1]) for edge in keep]
-        else:
-            weightless_keep = keep
+        weightless_keep = set((edge[0], edge[1]) for edge in keep)
         # add targeted swaps so edges are preserved across networks
         for edge in keep:
             if (edge[0], edge[1]) in null.edges:
@@ -271,11 +497,9 @@ def _randomize_dyads(network, keep, timeout):
             else:
                 # generate list of neighbours where
                 # edge is not in core
-                removed_core = deepcopy(null)
-                removed_core.remove_edges_from(weightless_keep)
                 try:
-                    neighbour1 = sample(list(nx.neighbors(removed_core, edge[0])), 1)
-                    neighbour2 = sample(list(nx.neighbors(removed_core, edge[1])), 1)
+                    neighbour1 = sample(_non_core_neighbours(null, edge[0], weightless_keep), 1)
+                    neighbour2 = sample(_non_core_neighbours(null, edge[1], weightless_keep), 1)
                 except (ValueError, nx.NetworkXError):
                     # 2 possibilities:
                     # node is not connected in this specific graph
@@ -290,9 +514,7 @@ def _randomize_dyads(network, keep, timeout):
                     # also remove one edge
                     preserve_deg = False
                     # make sure not to delete edges in core
-                    del_edges = null.edges
-                    for other_edge in keep:
-                        del_edges = [x for x in del_edges if x != (other_edge[0], other_edge[1])]
+                    del_edges = [x for x in null.edges if x not in weightless_keep]
                     try:
                         del_edge = sample(del_edges, 1)[0]
                         null.remove_edge(del_edge[0], del_edge[1])
@@ -323,11 +545,26 @@ def _randomize_dyads(network, keep, timeout):
     return null, timeout, preserve_deg
 
 
+def _non_core_neighbours(network, node, core):
+    """
+    Returns the neighbours of a node that are not connected to it by a core edge.
+
+    :param network: NetworkX object
+    :param node: Node in the network
+    :param core: Set of core edges as node tuples
+    :return: List of neighbours
+    """
+    return [x for x in nx.neighbors(network, node)
+            if (node, x) not in core and (x, node) not in core]
+
+
 def _generate_rows(values):
     """
     Generates dictionaries with necessary data for the pandas dataframes.
     While this function should be in set.py, the multiprocessing
     function needs it to be imported from here.
+    The networks can be replaced by their keys from _edge_keys,
+    which are much cheaper to send to a worker than NetworkX objects.
 
     :param values: Dictionary containing values for new pandas rows
     :return: Pandas dataframe with new rows
@@ -346,6 +583,7 @@ def _generate_rows(values):
     full_name = name + ' networks'
     if fraction is not None:
         name += ' size: ' + str(fraction) + ' prev:' + str(prev)
+    difference, intersections = _set_sizes(networks, sizes, sign)
     data = list()
     data.append({'Network': name,
                  'Group': group,
@@ -353,7 +591,7 @@ def _generate_rows(values):
                  'Conserved fraction': fraction,
                  'Prevalence of conserved fraction': prev,
                  'Set type': 'Difference',
-                 'Set size': _difference(networks, sign),
+                 'Set size': difference,
                  'Set type (absolute)': None,
                  'Samples': len(networks)})
     for size in sizes:
@@ -363,12 +601,39 @@ def _generate_rows(values):
                      'Conserved fraction': fraction,
                      'Prevalence of conserved fraction': prev,
                      'Set type': 'Intersection ' + str(size),
-                     'Set size': _intersection(networks, float(size), sign),
+                     'Set size': intersections[size],
                      'Set type (absolute)': str(len(networks) * float(size)),
                      'Samples': len(networks)})
     return data
 
 
+def _set_sizes(networks, sizes, sign):
+    """
+    Returns the size of the difference and the intersections of a list of networks.
+    The number of networks containing each edge is only counted once,
+    and all set sizes are then selected from these counts.
+
+    :param networks: List of input networks
+    :param sizes: List of fractions of networks that an edge needs to be a part of
+    :param sign: If true, the sets take sign information into account.
+    :return: Size of difference, dictionary with intersection size per size
+    """
+    keys, nodes = _edge_keys(networks, sign)
+    counts = _count_keys(keys)[1]
+    # edges that occur in only one network are unique
+    difference = int(np.count_nonzero(counts == 1))
+    intersections = dict()
+    for size in sizes:
+        threshold = round(float(size) * len(networks))
+        if threshold <= 1:
+            # see _intersection; there is no intersection for a threshold of 1 or lower
+            intersections[size] = 0
+        else:
+            # a threshold above the number of networks cannot be reached, so that intersection is empty
+            intersections[size] = int(np.count_nonzero(counts >= threshold))
+    return difference, intersections
+
+
 def _difference(networks, sign):
     """
     This function returns the size of the difference for a list of networks.
@@ -379,23 +644,10 @@ def _difference(networks, sign):
     :param sign: If true, the difference take sign information into account.
     :return: Size of difference
     """
-    diff = list()
-    for network in networks:
-        for edge in network[1].edges:
-            if sign:
-                diff.append(edge + (np.sign(network[1].edges[edge]['weight']),))
-            else:
-                diff.append(edge)
-    unique_edges = 0
-    for edge in set(diff):
-        if sign:
-            count = diff.count(edge) + diff.count((edge[1], edge[0], edge[2]))
-        else:
-            count = diff.count(edge) + diff.count((edge[1], edge[0]))
-        # handles occurrence of reversed edges in list
-        if count == 1:
-            unique_edges += 1
-    return unique_edges
+    keys, nodes = _edge_keys(networks, sign)
+    counts = _count_keys(keys)[1]
+    # edges that occur in only one network are unique
+    return int(np.count_nonzero(counts == 1))
 
 
 def _intersection(networks, size, sign, edgelist=False):
@@ -415,33 +667,272 @@ def _intersection(networks, size, sign, edgelist=False):
     :param edgelist: If true, returns the list of edges instead of the edge number.
     :return: Edge number or list of edges
     """
-    intersection_edges = []
-    matches = list()
+    keys, nodes = _edge_keys(networks, sign)
+    threshold = round(size * len(networks))
+    if threshold <= 1:
+        # The edges should be present in a fraction of networks bigger than 0,
+        # otherwise intersection size is identical to the difference
+        # Should also be bigger than 1 otherwise there is not really an intersection
+        shared = np.empty(0, dtype=np.int64)
+    elif threshold == len(networks):
+        # edges in every network are found without counting
+        shared = _full_intersection(keys)
+    elif threshold > len(networks):
+        # no edge can be present in more networks than there are
+        shared = np.empty(0, dtype=np.int64)
+    else:
+        unique, counts = _count_keys(keys)
+        shared = unique[counts >= threshold]
+    if edgelist:
+        return _decode_edge_keys(shared, nodes, sign)
+    else:
+        return len(shared)
+
+
+def _intersections(networks, sizes, sign):
+    """
+    Returns the intersections of a list of networks for several sizes.
+    The number of networks containing each edge is only counted once,
+    and each partial intersection is then selected from these counts.
+
+    :param networks: List of input networks
+    :param sizes: List of fractions of networks that an edge needs to be a part of
+    :param sign: If true, the intersections take sign information into account.
+    :return: Dictionary with list of edges per size
+    """
+    keys, nodes = _edge_keys(networks, sign)
+    unique = counts = None
+    intersections = dict()
+    for size in sizes:
+        threshold = round(float(size) * len(networks))
+        if threshold <= 1:
+            # see _intersection; there is no intersection for a threshold of 1 or lower
+            shared = np.empty(0, dtype=np.int64)
+        elif threshold == len(networks):
+            # the default full intersection does not need counts
+            shared = _full_intersection(keys)
+        elif threshold > len(networks):
+            # see _intersection; no edge can be present in more networks than there are
+            shared = np.empty(0, dtype=np.int64)
+        else:
+            if counts is None:
+                unique, counts = _count_keys(keys)
+            shared = unique[counts >= threshold]
+        intersections[size] = _decode_edge_keys(shared, nodes, sign)
+    return intersections
+
+
+def _count_keys(keys):
+    """
+    Counts the number of networks that contain each key.
+    The keys of each network are already sorted,
+    so a stable sort only needs to merge these runs
+    instead of sorting the concatenated keys from scratch.
+
+    :param keys: List with a sorted array of keys per network
+    :return: Array of unique keys, array with counts per key
+    """
+    keys = np.sort(np.concatenate(keys), kind='stable')
+    if len(keys) == 0:
+        return keys, np.empty(0, dtype=np.int64)
+    # a new key starts wherever the sorted keys change
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    counts = np.diff(np.append(starts, len(keys)))
+    return keys[starts], counts
+
+
+def _full_intersection(keys):
+    """
+    Returns the keys that are present in every network.
+    The sorted keys are intersected starting with the smallest network,
+    so the intersection can stop as soon as it is empty.
+
+    :param keys: List with a sorted array of keys per network
+    :return: Array of shared keys
+    """
+    keys = sorted(keys, key=len)
+    shared = keys[0]
+    for network_keys in keys[1:]:
+        if len(shared) == 0:
+            break
+        shared = np.intersect1d(shared, network_keys, assume_unique=True)
+    return shared
+
+
+def _edge_keys(networks, sign):
+    """
+    Packs the edges of a list of networks into int64 keys,
+    so set operations can be carried out on NumPy arrays instead of lists of tuples.
+    Nodes are indexed in order of appearance and each key encodes the sorted node indices;
+    if sign is true, the sign of the edge weight is encoded as well.
+    Reversed edges therefore get the same key.
+
+    If the networks have already been replaced by their keys,
+    these are returned as they are; the node list is then empty.
+
+    :param networks: List of network tuples, with first part being the name,
+    second the Networkx object or a sorted array of keys.
+    :param sign: If true, the sign of the edge weight is part of the key.
+    :return: List with a sorted array of keys per network, list of nodes
+    """
+    if all(isinstance(network[1], np.ndarray) for network in networks):
+        return [network[1] for network in networks], list()
+    index = dict()
+    arrays = list()
     for network in networks:
-        for edge in network[1].edges:
-            if sign:
-                matches.append(tuple(sorted(edge)) + (np.sign(network[1].edges[edge]['weight']),))
-            else:
-                matches.append(tuple(sorted(edge)))
-    shared_edges = 0
-    # remove swapped edges
-    edges = set(matches)
-    for edge in edges:
+        nodes, pairs, signs = _edge_array(network[1])
+        if sign and signs is None:
+            raise KeyError('weight')
+        # maps the node indices of the network to the shared node indices
+        remap = np.array([index.setdefault(node, len(index)) for node in nodes], dtype=np.int64)
+        arrays.append((remap[pairs], signs))
+    keys = list()
+    for pairs, signs in arrays:
+        network_keys = pairs.min(axis=1) * len(index) + pairs.max(axis=1)
         if sign:
-            count = matches.count(edge) + matches.count((edge[1], edge[0], edge[2]))
+            # signs -1, 0 and 1 are stored as 0, 1 and 2
+            network_keys = network_keys * 3 + signs + 1
+        keys.append(np.sort(network_keys))
+    return keys, list(index)
+
+
+def _edge_array(network):
+    """
+    Returns the edges of a network as an array of node indices,
+    together with the node list and the signs of the edge weights.
+    The arrays are cached per NetworkX object, outside of its attributes,
+    so the edges of a network only need to be read once.
+    The cache is only checked against the number of nodes and edges,
+    so networks should not be changed after they have been imported.
+
+    :param network: NetworkX object
+    :return: List of nodes, array with node indices per edge, array with edge signs or None
+    """
+    cached = _edge_arrays.get(network)
+    if cached is not None and len(cached[0]) == network.number_of_nodes() \
+            and len(cached[1]) == network.number_of_edges():
+        return cached
+    nodes = list(network.nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    size = network.number_of_edges()
+    # node indices and weights are read in a single pass over the edge view
+    # and stored directly in an array, without building a list of tuples first;
+    # float64 holds node indices exactly
+    edges = np.fromiter(chain.from_iterable((index[u], index[v], np.nan if w is None else w)
+                                            for u, v, w in network.edges(data='weight')),
+                        dtype=np.float64, count=3 * size).reshape(-1, 3)
+    pairs = edges[:, :2].astype(np.int64)
+    weights = edges[:, 2]
+    if np.isnan(weights).any():
+        signs = None
+    else:
+        signs = np.sign(weights).astype(np.int64)
+    _edge_arrays[network] = (nodes, pairs, signs)
+    return _edge_arrays[network]
+
+
+def _null_graphs(nulls):
+    """
+    Iterates over the NetworkX objects in the null models returned by _generate_null_parallel.
+
+    :param nulls: List of network tuples, or list of lists of network tuples for positive controls
+    :return: Generator of NetworkX objects
+    """
+    for null in nulls:
+        if isinstance(null, tuple):
+            yield null[1]
         else:
-            count = matches.count(edge) + matches.count((edge[1], edge[0]))
-        # handles occurrence of reversed edges in list
-        if count >= round(size * len(networks)) > 1:
-            # The edges should be present in a fraction of networks bigger than 0,
-            # otherwise intersection size is identical to the difference
-            # Should also be bigger than 1 otherwise there is not really an intersection
-            shared_edges += 1
-            intersection_edges.append(edge)
-    if edgelist:
-        return intersection_edges
+            for network in null:
+                yield network[1]
+
+
+def _store_edge_arrays(nulls, arrays):
+    """
+    Adds edge arrays that were computed in a worker process to the cache of _edge_array.
+
+    :param nulls: List of network tuples, or list of lists of network tuples for positive controls
+    :param arrays: List of edge arrays, in the order of _null_graphs
+    :return:
+    """
+    for network, array in zip(_null_graphs(nulls), arrays):
+        _edge_arrays[network] = array
+
+
+def _pack_network(network):
+    """
+    Packs a network into its node list, edge array and edge weights.
+    These are much cheaper to send to worker processes than a NetworkX object,
+    and only contain what is needed to generate null models.
+
+    :param network: NetworkX object
+    :return: List of nodes, array with node indices per edge, array with edge weights or None
+    """
+    nodes, pairs, signs = _edge_array(network)
+    weights = nx.get_edge_attributes(network, 'weight')
+    if weights:
+        weights = np.array([weights.get(edge, np.nan) for edge in network.edges], dtype=np.float64)
+    else:
+        weights = None
+    return nodes, pairs, weights
+
+
+def _unpack_network(packed):
+    """
+    Rebuilds a network from the arrays constructed by _pack_network.
+
+    :param packed: List of nodes, array with node indices per edge, array with edge weights or None
+    :return: NetworkX object
+    """
+    nodes, pairs, weights = packed
+    network = nx.Graph()
+    network.add_nodes_from(nodes)
+    if weights is None:
+        network.add_edges_from((nodes[u], nodes[v]) for u, v in pairs.tolist())
     else:
-        return shared_edges
+        for (u, v), weight in zip(pairs.tolist(), weights.tolist()):
+            if np.isnan(weight):
+                network.add_edge(nodes[u], nodes[v])
+            else:
+                network.add_edge(nodes[u], nodes[v], weight=weight)
+    return network
+
+
+def _update_digest(digest, network):
+    """
+    Adds the nodes and edges of a network to a hashlib digest.
+    The cached edge array is used, so the edges are not read again.
+
+    :param digest: Hash object from hashlib
+    :param network: NetworkX object
+    :return:
+    """
+    nodes, pairs, signs = _edge_array(network)
+    digest.update(repr(nodes).encode())
+    digest.update(pairs.tobytes())
+    if signs is not None:
+        digest.update(signs.tobytes())
+
+
+def _decode_edge_keys(keys, nodes, sign):
+    """
+    Converts int64 keys constructed by _edge_keys back to edge tuples.
+    Edges are returned with sorted nodes and, if sign is true, the sign of the edge weight.
+
+    :param keys: Array of keys
+    :param nodes: List of nodes returned by _edge_keys
+    :param sign: If true, the keys contain the sign of the edge weight.
+    :return: List of edges
+    """
+    edges = list()
+    for key in keys.tolist():
+        if sign:
+            key, edge_sign = divmod(key, 3)
+        first, second = divmod(key, len(nodes))
+        edge = tuple(sorted((nodes[first], nodes[second])))
+        if sign:
+            edge += (np.sign(edge_sign - 1.0),)
+        edges.append(edge)
+    return edges
 
 
 def _construct_intersection(networks, shared_edges):
@@ -449,37 +940,45 @@ def _construct_intersection(networks, shared_edges):
     From a list of networks and a list of shared edges,
     this function creates the intersection network
     with all metadata preserved as lists.
+    Edges and nodes are collected with their attributes first,
+    so the graph is built in one pass instead of updated per edge.
     :param networks:
     :param shared_edges:
     :return:
     """
     g = nx.Graph()
+    edges = list()
+    warned = False
+    adjacencies = [(x[0], x[1].adj) for x in networks]
     for edge in shared_edges:
-        g.add_edge(edge[0], edge[1])
         # add weights
-        try:
-            all_weights = dict()
-            for x in networks:
-                if edge in x[1].edges:
-                    all_weights[x[0]] = x[1].edges[edge[0], edge[1]]['weight']
-            mean_weight = float(np.mean(list(all_weights.values())))
-            g.edges[edge[0], edge[1]]['weight'] = mean_weight
-            g.edges[edge[0], edge[1]]['all weights'] = str(all_weights)
-        except KeyError:
-            logger.warning('No edge weights in network')
+        all_weights = dict()
+        for name, adj in adjacencies:
+            try:
+                data = adj[edge[0]][edge[1]]
+            except KeyError:
+                continue
+            if 'weight' not in data:
+                all_weights = None
+                break
+            all_weights[name] = data['weight']
+        if all_weights is None:
+            if not warned:
+                logger.warning('No edge weights in network')
+                warned = True
+            edges.append((edge[0], edge[1], {}))
+        else:
+            weights = list(all_weights.values())
+            edges.append((edge[0], edge[1], {'weight': float(sum(weights) / len(weights)),
+                                             'all weights': str(all_weights)}))
+    g.add_edges_from(edges)
     for node in g.nodes:
         # assumes node metadata is same across networks,
         # and takes first hit metadata
-        found = False
-        i = 0
-        while not found:
-            network = networks[i]
-            i = i + 1
+        for network in networks:
             if node in network[1].nodes:
-                found = True
-                data = network[1].nodes[node]
-                for val in data:
-                    g.nodes[node][val] = data[val]
+                g.nodes[node].update(network[1].nodes[node])
+                break
     return g
 
 
@@ -489,24 +988,46 @@ def _get_union(networks):
     :param networks: List of network tuples, with first part being the name, second the Networkx object.
     :return:
     """
-    all_edges = list()
+    return list(_iter_union(networks))
+
+
+def _get_union_size(networks):
+    """
+    Returns the number of edges in the union of a list of network tuples,
+    without storing the edges of the union.
+    :param networks: List of network tuples, with first part being the name, second the Networkx object.
+    :return: Number of edges
+    """
+    return sum(1 for edge in _iter_union(networks))
+
+
+def _iter_union(networks):
+    """
+    Generates the union of all edges for list of network tuples.
+    Edges are generated in order of appearance; a set of seen edges
+    replaces membership tests on a growing edge list.
+    :param networks: List of network tuples, with first part being the name, second the Networkx object.
+    :return: Generator of edges
+    """
+    seen = set()
     for network in networks:
         weights = nx.get_edge_attributes(network[1], 'weight')
         if weights:
             # network has edge weight properties,
             # need to be considered separate edges
             for edge in weights:
-                if ((edge[0], edge[1], weights[edge]) in all_edges
-                        or (edge[1], edge[0], weights[edge]) in all_edges):
+                if ((edge[0], edge[1], weights[edge]) in seen
+                        or (edge[1], edge[0], weights[edge]) in seen):
                     pass
                 else:
-                    all_edges.append((edge[0], edge[1], weights[edge]))
+                    seen.add((edge[0], edge[1], weights[edge]))
+                    yield edge[0], edge[1], weights[edge]
         else:
             # network does not have edge properties
             for edge in weights:
-                if ((edge[0], edge[1]) in all_edges
-                        or (edge[1], edge[0]) in all_edges):
+                if ((edge[0], edge[1]) in seen
+                        or (edge[1], edge[0]) in seen):
                     pass
                 else:
-                    all_edges.append((edge[0], edge[1]))
-    return all_edges
\ No newline at end of file
+                    seen.add((edge[0], edge[1]))
+                    yield edge[0], edge[1]
@@ -10,12 +10,13 @@ __status__ = 'Development'
 __license__ = 'Apache 2.0'
 
 import unittest
+import os
+import tempfile
 import networkx as nx
 import numpy as np
 from anuran.centrality import generate_ci_frame, generate_confidence_interval, \
-    _generate_ci_rows
+    _generate_ci_rows, _graph_hash
 from anuran.utils import _generate_centralities_parallel, _centrality_percentile
-import pandas as pd
 
 
 # generate three alternative networks with first 4 edges conserved but rest random
@@ -79,6 +80,37 @@ class TestMain(unittest.TestCase):
         totalnodes = np.sum([len(networks[x][0][1].nodes) for x in networks])
         self.assertEqual(len(results), totalnodes*3)
 
+    def test_generate_ci_frame_cache(self):
+        """
+        When a cache directory is given, the second call
+        should return the stored dataframe.
+        """
+        random = {x: {'random': [], 'core': {}} for x in networks}
+        degree = {x: {'degree': [], 'core': {}} for x in networks}
+        with tempfile.TemporaryDirectory() as cache:
+            results = generate_ci_frame(networks, random=random, degree=degree,
+                                        fractions=None, prev=None, perm=0, core=1, cache=cache)
+            cached = generate_ci_frame(networks, random=random, degree=degree,
+                                       fractions=None, prev=None, perm=0, core=1, cache=cache)
+        self.assertTrue(results.equals(cached))
+
+    def test_generate_ci_frame_cache_truncated(self):
+        """
+        When the cached dataframe was only partially written,
+        it should be calculated again.
+        """
+        random = {x: {'random': [], 'core': {}} for x in networks}
+        degree = {x: {'degree': [], 'core': {}} for x in networks}
+        with tempfile.TemporaryDirectory() as cache:
+            results = generate_ci_frame(networks, random=random, degree=degree,
+                                        fractions=None, prev=None, perm=0, core=1, cache=cache)
+            for file in os.listdir(cache):
+                with open(os.path.join(cache, file), 'r+b') as handle:
+                    handle.truncate(10)
+            cached = generate_ci_frame(networks, random=random, degree=degree,
+                                       fractions=None, prev=None, perm=0, core=1, cache=cache)
+        self.assertTrue(results.equals(cached))
+
     def test_generate_centralities(self):
         """
         Tests whether the generate_centralities function returns a ranking of centralities.
@@ -94,26 +126,37 @@ class TestMain(unittest.TestCase):
         """
         new = [networks['a'][0], networks['b'][0], networks['c'][0]]
         ranking = _generate_centralities_parallel(new)
-        centrality_scores = [(ranking[i][0], ranking[i][2]['Betweenness']) for i in range(len(ranking))]
+        centrality_scores = [x[2]['Betweenness'] for x in ranking]
         CI = generate_confidence_interval(centrality_scores)
         self.assertEqual(CI['OTU_1'], (0, 1))
 
     def test__generate_ci_rows(self):
         """
-        Tests whether a dataframe is returned with a length equal to
+        Tests whether columns are returned with a length equal to
         3 times the number of nodes.
         :return:
         """
         new = {'a': [('a', networks['a'][0][1]),
                      ('b', networks['b'][0][1]),
                      ('c', networks['c'][0][1])]}
-        results = pd.DataFrame(columns=['Node', 'Network', 'Group', 'Network type', 'Conserved fraction',
-                                        'Prevalence of conserved fraction',
-                                        'Centrality', 'Upper limit', 'Lower limit', 'Values'])
+        results = {column: list() for column in ['Node', 'Network', 'Group', 'Network type', 'Conserved fraction',
+                                                 'Prevalence of conserved fraction',
+                                                 'Centrality', 'Upper limit', 'Lower limit', 'Values']}
         central_new = _generate_centralities_parallel(new['a'])
-        results = _generate_ci_rows(data=results, name='a', group='a', networks=central_new, fraction=None, prev=None)
+        results = _generate_ci_rows(rows=results, name='a', group='a', networks=central_new, fraction=None, prev=None)
         nodes = np.sum(len(x[1].nodes) for x in networks['a'])
-        self.assertEqual(nodes*3, len(results))
+        self.assertEqual(nodes*3, len(results['Node']))
+
+    def test_graph_hash(self):
+        """
+        Networks with the same nodes and edges should have the same hash,
+        regardless of the order in which edges were added.
+        """
+        copy = nx.Graph()
+        copy.add_nodes_from(nodes)
+        copy.add_edges_from([(x[1], x[0]) for x in reversed(one)])
+        self.assertEqual(_graph_hash(a), _graph_hash(copy))
+        self.assertNotEqual(_graph_hash(a), _graph_hash(b))
 
     def centrality_percentile(self):
         """
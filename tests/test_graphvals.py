@@ -10,9 +10,10 @@ __status__ = 'Development'
 __license__ = 'Apache 2.0'
 
 import unittest
+import random
 import networkx as nx
-import pandas as pd
-from anuran.graphvals import generate_graph_frame, generate_graph_properties, _generate_graph_rows
+from anuran.graphvals import generate_graph_frame, generate_graph_properties, _generate_graph_rows, \
+    _approx_connectivity
 
 # generate three alternative networks with first 4 edges conserved but rest random
 nodes = ["OTU_1", "OTU_2", "OTU_3", "OTU_4", "OTU_5"]
@@ -89,13 +90,28 @@ class TestMain(unittest.TestCase):
         """
         Tests whether this function adds a new row if supplied the correct parameters.
         """
-        frame = pd.DataFrame(columns=['Network', 'Group', 'Network type', 'Conserved fraction',
-                                      'Prevalence of conserved fraction',
-                                      'Property', 'Value'])
-        frame = _generate_graph_rows(data=frame, name='test', group='a',
+        frame = list()
+        frame = _generate_graph_rows(rows=frame, name='test', group='a',
                                      networks=networks['a'], fraction=None, prev=None, perm=3)
         self.assertEqual(len(frame), 5)
 
+    def test_approx_connectivity(self):
+        """
+        Tests whether the sampled connectivity is correct for a network with more pairs than samples.
+        Every pair of nodes in a complete network has the same connectivity.
+        """
+        self.assertEqual(_approx_connectivity(nx.complete_graph(12), k=50), 11)
+
+    def test_approx_connectivity_sampled(self):
+        """
+        Tests whether the sampled connectivity of a network with nodes of different degrees
+        is close to the exact average node connectivity.
+        """
+        network = nx.gnm_random_graph(25, 80, seed=3)
+        random.seed(0)
+        approx = _approx_connectivity(network, k=100)
+        self.assertAlmostEqual(approx, nx.average_node_connectivity(network), delta=0.75)
+
 
 if __name__ == '__main__':
     unittest.main()
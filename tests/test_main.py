@@ -0,0 +1,89 @@
+"""
+This file contains a testing function + resources for testing whether the output tables
+from main.py are written correctly.
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import unittest
+import os
+import shutil
+import tempfile
+from multiprocessing.pool import ThreadPool
+import numpy as np
+import pandas as pd
+from scipy.sparse import load_npz
+from anuran.main import _save_frame, _save_intersection, _save_frame_async, _finish_writes, _check_format
+
+frame = pd.DataFrame({'Network': ['a', 'b'], 'Edges': [3, 4]})
+
+
+class TestMain(unittest.TestCase):
+    """
+    Tests whether the output tables are written.
+    """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_save_frame(self):
+        """Checks whether a table with tuples is written to csv and can be read back. """
+        data = frame.copy()
+        data['Pairs'] = [[('OTU_1', 'OTU_2')], [('OTU_2', 'OTU_3')]]
+        fp = _save_frame(data, os.path.join(self.dir, 'sets'), 'csv')
+        self.assertEqual(fp, os.path.join(self.dir, 'sets.csv'))
+        result = pd.read_csv(fp, index_col=0)
+        self.assertEqual(list(result['Edges']), [3, 4])
+        self.assertEqual(list(result['Pairs']), [str(x) for x in data['Pairs']])
+
+    def test_check_format(self):
+        """Checks whether the columnar formats fall back to csv without pyarrow. """
+        self.assertEqual(_check_format('csv'), 'csv')
+        try:
+            import pyarrow
+            expected = 'parquet'
+        except ImportError:
+            expected = 'csv'
+        self.assertEqual(_check_format('parquet'), expected)
+
+    def test_save_intersection(self):
+        """Checks whether an intersection is written as a symmetric sparse matrix. """
+        edges = [('OTU_1', 'OTU_2', 1), ('OTU_2', 'OTU_3', -1), ('OTU_3', 'OTU_3', 1)]
+        fp = _save_intersection(edges, os.path.join(self.dir, 'intersection'))
+        matrix = load_npz(fp).toarray()
+        nodes = list(np.load(fp)['nodes'])
+        self.assertEqual(nodes, ['OTU_1', 'OTU_2', 'OTU_3'])
+        self.assertTrue((matrix == matrix.T).all())
+        self.assertEqual(matrix[0, 1], 1)
+        self.assertEqual(matrix[1, 2], -1)
+        # self-loops are stored once
+        self.assertEqual(matrix[2, 2], 1)
+        self.assertEqual(np.count_nonzero(matrix), 5)
+
+    def test_finish_writes(self):
+        """Checks whether queued tables are written before the writer finishes. """
+        writer = ThreadPool(2)
+        writes = list()
+        _save_frame_async(writer, writes, frame, os.path.join(self.dir, 'sets'), 'csv', name='Set sizes')
+        _finish_writes(writer, writes)
+        self.assertTrue(os.path.isfile(os.path.join(self.dir, 'sets.csv')))
+
+    def test_finish_failed_writes(self):
+        """Checks whether a failed write stops anuran with an error code. """
+        writer = ThreadPool(2)
+        writes = list()
+        _save_frame_async(writer, writes, frame, os.path.join(self.dir, 'missing', 'sets'), 'csv')
+        with self.assertRaises(SystemExit) as exit:
+            _finish_writes(writer, writes)
+        self.assertEqual(exit.exception.code, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
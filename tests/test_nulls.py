@@ -10,10 +10,14 @@ __status__ = 'Development'
 __license__ = 'Apache 2.0'
 
 import unittest
+import io
+import os
+import tempfile
 import networkx as nx
 import numpy as np
 from anuran.nulls import generate_null
-from anuran.utils import _randomize_network, _randomize_dyads
+from anuran.utils import _randomize_network, _random_networks, _randomize_dyads, _get_union, _get_union_size, \
+    _pack_network, _unpack_network, _edge_array
 
 # generate three alternative networks with first 4 edges conserved but rest random
 nodes = ["OTU_1", "OTU_2", "OTU_3", "OTU_4", "OTU_5"]
@@ -76,6 +80,32 @@ class TestMain(unittest.TestCase):
         self.assertEqual(len(random['a']['random'][0]), perm)
         self.assertEqual(len(random['a']['random']), len(networks['a']))
 
+    def test_generate_null_cache(self):
+        """
+        Checks whether null models are loaded from the cache
+        when generate_null is called again with the same settings.
+        """
+        with tempfile.TemporaryDirectory() as cache:
+            random, degree = generate_null(networks, n=5, npos=5, core=2, cache=cache)
+            cached_random, cached_degree = generate_null(networks, n=5, npos=5, core=2, cache=cache)
+        self.assertEqual([list(x[1].edges) for x in random['a']['random'][0]],
+                         [list(x[1].edges) for x in cached_random['a']['random'][0]])
+
+    def test_generate_null_cache_truncated(self):
+        """
+        Checks whether null models are generated again
+        when a cache file was only partially written.
+        """
+        with tempfile.TemporaryDirectory() as cache:
+            generate_null(networks, n=5, npos=5, core=2, cache=cache)
+            files = sorted(os.listdir(cache))
+            with open(os.path.join(cache, files[0]), 'r+b') as file:
+                file.truncate(10)
+            random, degree = generate_null(networks, n=5, npos=5, core=2, cache=cache)
+            self.assertEqual(sorted(os.listdir(cache)), files)
+        self.assertEqual(len(random['a']['random'][0]), 5)
+        self.assertEqual(len(degree['a']['degree'][0]), 5)
+
     def test_generate_core(self):
         """
         Checks whether the specified number of randomized models is returned.
@@ -89,6 +119,36 @@ class TestMain(unittest.TestCase):
         b.sort()
         self.assertEqual(a[0], b[0])
 
+    def test_get_union(self):
+        """
+        Checks whether edges with different weights are kept separately in the union.
+        """
+        union = _get_union([('a', a), ('b', b), ('c', c)])
+        self.assertEqual(len(union), 10)
+        self.assertIn(("OTU_1", "OTU_2", -1.0), union)
+        self.assertEqual(_get_union_size([('a', a), ('b', b), ('c', c)]), 10)
+
+    def test_pack_network(self):
+        """
+        Checks whether a packed network is unpacked with the same nodes and weighted edges.
+        """
+        unpacked = _unpack_network(_pack_network(a))
+        self.assertEqual(list(unpacked.nodes), list(a.nodes))
+        self.assertEqual(nx.get_edge_attributes(unpacked, 'weight'), nx.get_edge_attributes(a, 'weight'))
+
+    def test_edge_array(self):
+        """
+        Checks whether edge arrays are cached outside of the graph attributes,
+        so the network can still be exported, and whether removed edges are noticed.
+        """
+        network = a.copy()
+        nodes, pairs, signs = _edge_array(network)
+        self.assertEqual(len(pairs), network.number_of_edges())
+        self.assertNotIn('_edge_array', network.graph)
+        nx.write_graphml(network, io.BytesIO())
+        network.remove_edge(*list(network.edges)[0])
+        self.assertEqual(len(_edge_array(network)[1]), network.number_of_edges())
+
     def test_randomize_network(self):
         """
         Checks whether a randomized network is returned.
@@ -98,6 +158,19 @@ class TestMain(unittest.TestCase):
         new_deg = np.sort(nx.degree(random))
         self.assertFalse((orig_deg == new_deg).all())
 
+    def test_random_networks(self):
+        """
+        Checks whether randomized networks keep the node and edge number
+        and the edge weights of the input network.
+        """
+        randoms = _random_networks(a, n=5)
+        self.assertEqual(len(randoms), 5)
+        for random in randoms:
+            self.assertEqual(len(random), len(a))
+            self.assertEqual(len(random.edges), len(a.edges))
+            self.assertCountEqual(nx.get_edge_attributes(random, 'weight').values(),
+                                  nx.get_edge_attributes(a, 'weight').values())
+
     def test_randomize_dyads(self):
         """
         Checks whether a network with swapped dyads is returned.
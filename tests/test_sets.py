@@ -12,9 +12,12 @@ __license__ = 'Apache 2.0'
 import unittest
 import networkx as nx
 from anuran.nulls import generate_null
-from anuran.sets import generate_sizes, generate_sample_sizes, generate_size_differences
-from anuran.utils import _difference, _intersection, _generate_rows
+from anuran.sets import generate_sizes, generate_sample_sizes, generate_size_differences, \
+    _random_combinations, _unrank_combination
+from anuran.utils import _difference, _intersection, _intersections, _set_sizes, _edge_keys, \
+    _generate_rows
 from scipy.special import binom
+from itertools import combinations
 import pandas as pd
 
 # generate three alternative networks with first 4 edges conserved but rest random
@@ -97,6 +100,35 @@ class TestMain(unittest.TestCase):
         results = _intersection([networks['a'][0], networks['b'][0], networks['c'][0]], size=1, sign=True)
         self.assertEqual(results, 3)
 
+    def test_intersection_edgelist(self):
+        """Checks whether the intersection edges are returned with sorted nodes and sign. """
+        results = _intersection([networks['a'][0], networks['b'][0], networks['c'][0]], size=1, sign=True,
+                                edgelist=True)
+        self.assertCountEqual(results, [("OTU_1", "OTU_3", 1), ("OTU_2", "OTU_5", 1), ("OTU_3", "OTU_4", -1)])
+
+    def test_intersections(self):
+        """Checks whether intersections for several sizes match the intersection of each size. """
+        group = [networks['a'][0], networks['b'][0], networks['c'][0]]
+        results = _intersections(group, sizes=[0.3, 0.6, 1], sign=True)
+        for size in [0.3, 0.6, 1]:
+            self.assertCountEqual(results[size], _intersection(group, size=size, sign=True, edgelist=True))
+
+    def test_set_sizes(self):
+        """Checks whether set sizes from shared counts match the separate set operations. """
+        group = [networks['a'][0], networks['b'][0], networks['c'][0]]
+        for sign in [True, False]:
+            difference, intersections = _set_sizes(group, sizes=[0.3, 0.6, 1, 1.5], sign=sign)
+            self.assertEqual(difference, _difference(group, sign=sign))
+            for size in [0.3, 0.6, 1, 1.5]:
+                self.assertEqual(intersections[size], _intersection(group, size=size, sign=sign))
+            # no edge can be shared by more networks than there are
+            self.assertEqual(intersections[1.5], 0)
+            self.assertEqual(len(_intersections(group, sizes=[1.5], sign=sign)[1.5]), 0)
+            # networks that were replaced by their keys give the same sizes
+            keys = _edge_keys(group, sign=sign)[0]
+            packed = [(network[0], key) for network, key in zip(group, keys)]
+            self.assertEqual(_set_sizes(packed, sizes=[0.3, 0.6, 1, 1.5], sign=sign), (difference, intersections))
+
     def test_difference(self):
         """Checks whether the difference set size is correctly returned. """
         results = _difference([networks['a'][0], networks['b'][0], networks['c'][0]], sign=True)
@@ -120,6 +152,19 @@ class TestMain(unittest.TestCase):
         num = 42 * binom(3, 3) + 42 * binom(3, 2) + 42 * binom(3, 1)
         self.assertEqual(int(len(results)), int(num))
 
+    def test_random_combinations(self):
+        """Checks whether sampled combinations are distinct and have the right size. """
+        for number in [3, 40]:
+            results = _random_combinations(10, 3, number, int(binom(10, 3)))
+            self.assertEqual(len(results), number)
+            self.assertEqual(len(set(tuple(sorted(x)) for x in results)), number)
+            self.assertTrue(all(len(set(x)) == 3 and max(x) < 10 for x in results))
+
+    def test_unrank_combination(self):
+        """Checks whether combinations are unranked in the order of itertools.combinations. """
+        results = [_unrank_combination(i, 5, 3) for i in range(int(binom(5, 3)))]
+        self.assertEqual(results, list(combinations(range(5), 3)))
+
     def test_generate_sample_sizes_fractions(self):
         """Checks whether the subsampled set sizes are correctly returned. """
         perm = 10
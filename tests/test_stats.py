@@ -16,7 +16,7 @@ from anuran.sets import generate_sizes
 from anuran.centrality import generate_ci_frame
 from anuran.graphvals import generate_graph_frame
 from anuran.stats import compare_centralities, compare_graph_properties, \
-    compare_set_sizes, _generate_stat_rows, _value_outside_range
+    compare_set_sizes, _stat_row, _value_outside_range
 
 # generate three alternative networks with first 4 edges conserved but rest random
 nodes = ["OTU_1", "OTU_2", "OTU_3", "OTU_4", "OTU_5"]
@@ -108,16 +108,18 @@ class TestMain(unittest.TestCase):
         results = results[results['Measure'] == 'Intersection 0.6']
         self.assertGreater(0.1, results['P'].iloc[0])
 
-    def test_generate_stat_rows(self):
+    def test_stat_row(self):
         """
-        Given a pandas dataframe with results, this function should add a row.
+        Given the results of a test, this function should return a row
+        with the same columns as the statistics dataframes.
         """
         set_values = generate_sizes(networks, random, degree, fractions=None, prev=None, core=2,
                                     sign=True, perm=10, sizes=[0.6, 1])
         results = compare_set_sizes(set_values)
-        new_results = _generate_stat_rows(results, group='b', comparison='test',
-                                          operation='test', p='0.05', ptype='test', node=None)
-        self.assertGreater(len(new_results), len(results))
+        row = _stat_row(group='b', comparison='test', operation='test', p='0.05', ptype='test')
+        self.assertEqual(sorted(row), sorted(results.columns))
+        row = _stat_row(group='b', comparison='test', operation='test', p='0.05', ptype='test', node='OTU_1')
+        self.assertEqual(row['Node'], 'OTU_1')
 
     def test_value_outside_range(self):
         """